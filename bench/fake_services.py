@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+fake_services.py - local stand-in for the github REST api and jira search
+
+Serves the fixture written by bench/synthetic.py:
+
+    GET /repos/<org>/<repo>/pulls/<number>
+    GET /repos/<org>/<repo>/issues/<number>/comments     (paginated)
+    GET /repos/<org>/<repo>/issues/<number>/timeline     (paginated)
+    GET /repos/<org>/<repo>/commits/<sha>
+    GET /repos/<org>/<repo>/commits/<sha>/pulls
+    GET /repos/<org>/<repo>/branches
+    GET /rest/api/2/serverInfo
+    GET /rest/api/2/field
+    GET /rest/api/2/search
+    GET /rest/api/2/issue/<key>
+
+An optional per request latency makes cold and warm cache runs distinguishable
+and once the (optional) rate limit is used up every request gets a 403.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from logzero import logger
+
+
+PER_PAGE = 30
+
+
+class FakeServices:
+
+    def __init__(self, fixture_file, host='127.0.0.1', port=0, latency=0.0, ratelimit=5000):
+        with open(fixture_file, 'r') as f:
+            self.fixture = json.loads(f.read())
+        self.latency = latency
+        self.ratelimit = ratelimit
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'fake services listening on {self.base_url}')
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self):
+        '''Return the remaining rate limit, or None once it is used up'''
+        with self._lock:
+            self.requests_served += 1
+            if self.ratelimit == 0:
+                return None
+            self.ratelimit -= 1
+            return self.ratelimit
+
+    def _paginate(self, items, query, path):
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', [str(PER_PAGE)])[0])
+        start = (page - 1) * per_page
+        links = {}
+        if start + per_page < len(items):
+            links['next'] = f'{self.base_url}{path}?page={page + 1}&per_page={per_page}'
+        return items[start:start + per_page], links
+
+    def _jira_search(self, query):
+        jql = query.get('jql', [''])[0]
+        start_at = int(query.get('startAt', ['0'])[0])
+        max_results = int(query.get('maxResults', ['50'])[0])
+
+        issues = self.fixture.get('jira_issues', [])
+        match = re.search(r'project\s*=\s*"?(\w+)"?', jql)
+        if match:
+            issues = [x for x in issues if x['key'].startswith(match.group(1) + '-')]
+        reverse = 'desc' in jql.lower()
+        issues = sorted(issues, key=lambda x: int(x['key'].rsplit('-', 1)[-1]), reverse=reverse)
+
+        return {
+            'startAt': start_at,
+            'maxResults': max_results,
+            'total': len(issues),
+            'issues': issues[start_at:start_at + max_results],
+        }
+
+    def route(self, path, query):
+        """Return (status, payload, links) for a GET request."""
+        parts = path.strip('/').split('/')
+        fx = self.fixture
+
+        if parts[:3] == ['rest', 'api', '2']:
+            rest = parts[3:]
+            if rest == ['serverInfo']:
+                return 200, {
+                    'baseUrl': self.base_url,
+                    'version': '8.20.0',
+                    'versionNumbers': [8, 20, 0],
+                    'deploymentType': 'Server',
+                }, {}
+            if rest == ['field']:
+                return 200, [], {}
+            if rest == ['search']:
+                return 200, self._jira_search(query), {}
+            if len(rest) == 2 and rest[0] == 'issue':
+                for issue in fx.get('jira_issues', []):
+                    if issue['key'] == rest[1]:
+                        return 200, issue, {}
+                return 404, {'errorMessages': ['Issue Does Not Exist'], 'errors': {}}, {}
+            return 404, {'errorMessages': ['Not Found'], 'errors': {}}, {}
+
+        if len(parts) < 4 or parts[0] != 'repos':
+            return 404, {'message': 'Not Found'}, {}
+
+        full_name = f'{parts[1]}/{parts[2]}'
+        rest = parts[3:]
+        ds = None
+
+        if rest == ['branches']:
+            ds = fx['branches'].get(full_name)
+        elif len(rest) == 2 and rest[0] == 'pulls':
+            ds = fx['pulls'].get(f'{full_name}/{rest[1]}')
+        elif len(rest) == 3 and rest[0] == 'issues' and rest[2] in ('comments', 'timeline'):
+            items = fx[rest[2]].get(f'{full_name}/{rest[1]}')
+            if items is not None:
+                page, links = self._paginate(items, query, path)
+                return 200, page, links
+        elif len(rest) == 2 and rest[0] == 'commits':
+            ds = fx['commits'].get(f'{full_name}/{rest[1]}')
+        elif len(rest) == 3 and rest[0] == 'commits' and rest[2] == 'pulls':
+            ds = fx['commit_pulls'].get(f'{full_name}/{rest[1]}', [])
+
+        if ds is None:
+            return 404, {'message': 'Not Found'}, {}
+        return 200, ds, {}
+
+    def _make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if services.latency:
+                    time.sleep(services.latency)
+                remaining = services._count()
+
+                parsed = urlparse(self.path)
+                if remaining is None:
+                    remaining = 0
+                    status, links = 403, {}
+                    payload = {'message': 'API rate limit exceeded for 127.0.0.1.'}
+                else:
+                    status, payload, links = services.route(parsed.path, parse_qs(parsed.query))
+                body = json.dumps(payload).replace('__API__', services.base_url).encode('utf-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-RateLimit-Remaining', str(remaining))
+                if links:
+                    self.send_header(
+                        'Link',
+                        ', '.join(f'<{url}>; rel="{rel}"' for rel, url in links.items())
+                    )
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixture', help='github.json written by bench/synthetic.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--ratelimit', type=int, default=5000)
+    args = parser.parse_args()
+
+    services = FakeServices(
+        args.fixture,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        ratelimit=args.ratelimit
+    )
+    logger.info(f'serving {os.path.abspath(args.fixture)} on {services.base_url}')
+    services.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+run_benchmarks.py - offline, reproducible benchmarks for the backport analyzer
+
+Generates a synthetic dataset (bench/synthetic.py), starts the local github/jira
+stand-in (bench/fake_services.py) and runs the analyzer against it with --profile
+for each scenario:
+
+    cold        no requests cache and no checkouts
+    warm        everything left over from the previous scenario
+    single      a warm run for a single issue
+    jira_sync   lib/jira_wrapper.py against the fake jira search
+
+One json line per scenario is appended to the results file so runs can be
+compared over time.
+
+    PYTHONPATH=. python bench/run_benchmarks.py --issues 200 --latency 0.02
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from logzero import logger
+
+from bench.fake_services import FakeServices
+from bench.synthetic import SyntheticGenerator
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ['cold', 'warm', 'single', 'jira_sync']
+
+
+def git_revision():
+    pid = subprocess.run(
+        'git rev-parse --short HEAD',
+        shell=True,
+        cwd=REPO_ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    return pid.stdout.decode('utf-8').strip() or None
+
+
+def summarize_profile(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        ds = json.loads(f.read())
+    return {
+        'wall_time': ds['wall_time'],
+        'http_requests': sum(x['count'] for x in ds['http'].values()),
+        'http_time': sum(x['total'] for x in ds['http'].values()),
+        'subprocesses': sum(x['count'] for x in ds['subprocesses'].values()),
+        'subprocess_time': sum(x['total'] for x in ds['subprocesses'].values()),
+        'caches': ds['caches'],
+        'stages': {k: v['total'] for k, v in ds['stages'].items()},
+    }
+
+
+class BenchmarkRunner:
+
+    def __init__(self, workdir, params, latency=0.0):
+        self.workdir = workdir
+        self.params = params
+        self.latency = latency
+        self.services = None
+
+    def setup(self):
+        SyntheticGenerator(self.workdir, **self.params).generate()
+        self.services = FakeServices(
+            os.path.join(self.workdir, 'github.json'),
+            latency=self.latency
+        )
+        self.services.start()
+
+    def teardown(self):
+        if self.services:
+            self.services.stop()
+
+    @property
+    def env(self):
+        env = dict(os.environ)
+        env.update({
+            'PYTHONPATH': REPO_ROOT,
+            'GITHUB_TOKEN': 'bench',
+            'GITHUB_API_URL': self.services.base_url,
+            'GITHUB_CLONE_URL': os.path.join(self.workdir, 'repos'),
+            'CHECKOUTS_DIR': os.path.join(self.workdir, 'checkouts'),
+            'JIRA_SERVER': self.services.base_url,
+            'JIRA_TOKEN': 'bench',
+        })
+        return env
+
+    def reset_caches(self):
+        for fn in ['github_cache.sqlite']:
+            fn = os.path.join(self.workdir, fn)
+            if os.path.exists(fn):
+                os.remove(fn)
+        shutil.rmtree(os.path.join(self.workdir, 'checkouts'), ignore_errors=True)
+
+    def first_issue_key(self):
+        with open(os.path.join(self.workdir, '.data', 'jiras.json'), 'r') as f:
+            return json.loads(f.read())[0]['key']
+
+    def run_scenario(self, name):
+        profile_fn = os.path.join(self.workdir, f'profile-{name}.json')
+        script = 'backport_analyzer.py'
+        args = []
+
+        if name == 'cold':
+            self.reset_caches()
+        elif name == 'single':
+            args = ['--issue', self.first_issue_key()]
+        elif name == 'jira_sync':
+            script = 'jira_wrapper.py'
+
+        cmd = [
+            sys.executable,
+            os.path.join(REPO_ROOT, 'lib', script),
+            '--profile',
+            '--profile-output',
+            profile_fn
+        ] + args
+
+        logger.info(f'scenario {name}: {" ".join(cmd)}')
+        served = self.services.requests_served
+        started = time.time()
+        pid = subprocess.run(
+            cmd,
+            cwd=self.workdir,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        elapsed = time.time() - started
+        if pid.returncode != 0:
+            logger.error(pid.stderr.decode('utf-8')[-2000:])
+
+        return {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'revision': git_revision(),
+            'scenario': name,
+            'params': self.params,
+            'latency': self.latency,
+            'returncode': pid.returncode,
+            'elapsed': elapsed,
+            'requests_served': self.services.requests_served - served,
+            'profile': summarize_profile(profile_fn),
+        }
+
+
+def load_previous(results_file):
+    previous = {}
+    if not os.path.exists(results_file):
+        return previous
+    with open(results_file, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            ds = json.loads(line)
+            key = (ds['scenario'], json.dumps(ds['params'], sort_keys=True), ds['latency'])
+            previous[key] = ds
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=50)
+    parser.add_argument('--repos', nargs='+', default=['ansible/galaxy_ng'])
+    parser.add_argument('--stable-branches', type=int, default=3)
+    parser.add_argument('--tags-per-branch', type=int, default=2)
+    parser.add_argument('--backport-ratio', type=float, default=0.7)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake api request')
+    parser.add_argument('--scenarios', nargs='+', default=['cold', 'warm', 'single'], choices=SCENARIOS)
+    parser.add_argument('--results', default='bench_results.jsonl')
+    parser.add_argument('--workdir', help='defaults to a temporary directory that is removed afterwards')
+    args = parser.parse_args()
+
+    params = {
+        'issues': args.issues,
+        'repos': args.repos,
+        'stable_branches': args.stable_branches,
+        'tags_per_branch': args.tags_per_branch,
+        'backport_ratio': args.backport_ratio,
+        'seed': args.seed,
+    }
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='backport-bench-')
+    if os.path.exists(workdir) and os.listdir(workdir):
+        raise Exception(f'{workdir} is not empty')
+
+    previous = load_previous(args.results)
+    runner = BenchmarkRunner(workdir, params, latency=args.latency)
+    results = []
+    try:
+        runner.setup()
+        for scenario in args.scenarios:
+            results.append(runner.run_scenario(scenario))
+    finally:
+        runner.teardown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.results, 'a') as f:
+        for ds in results:
+            f.write(json.dumps(ds, sort_keys=True) + '\n')
+
+    logger.info("--------------- BENCHMARKS ----------------")
+    logger.info(f"{'scenario':<12} {'rc':>3} {'elapsed':>9} {'previous':>9} {'served':>7}")
+    for ds in results:
+        key = (ds['scenario'], json.dumps(ds['params'], sort_keys=True), ds['latency'])
+        prev = previous.get(key)
+        prev_elapsed = f"{prev['elapsed']:.2f}" if prev else '-'
+        logger.info(
+            f"{ds['scenario']:<12} {ds['returncode']:>3} {ds['elapsed']:>9.2f}"
+            + f" {prev_elapsed:>9} {ds['requests_served']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
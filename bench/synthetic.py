@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+"""
+synthetic.py - build a synthetic jiras.json, git repositories and github fixture
+
+The generated tree looks like this:
+
+    <root>/.data/jiras.json     jira issues in the same shape the analyzer loads
+    <root>/repos/<org>/<repo>   git repositories to clone from, with stable branches,
+                                tags and cherry-picked backports
+    <root>/github.json          pulls, comments, timelines and commits served by
+                                bench/fake_services.py
+
+API urls inside github.json use the __API__ placeholder which the fake service
+replaces with its own base url.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+
+from logzero import logger
+
+
+API = '__API__'
+ISSUE_STATES = ['New', 'In Progress', 'Ready for QA', 'In QA', 'Done', 'Closed']
+GIT = ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com']
+
+
+def git(repo_dir, *args):
+    pid = subprocess.run(
+        GIT + list(args),
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True
+    )
+    return pid.stdout.decode('utf-8').strip()
+
+
+class SyntheticRepo:
+
+    def __init__(self, root, org, name, stable_versions, dev_version):
+        self.org = org
+        self.name = name
+        self.path = os.path.join(root, 'repos', org, name)
+        self.stable_versions = stable_versions
+        self.dev_version = dev_version
+        self.next_number = 1
+        self.backports = {x: [] for x in stable_versions}
+
+    @property
+    def full_name(self):
+        return f'{self.org}/{self.name}'
+
+    def html_url(self, number):
+        return f'https://github.com/{self.org}/{self.name}/pull/{number}'
+
+    def api_url(self, suffix):
+        return f'{API}/repos/{self.org}/{self.name}/{suffix}'
+
+    def init(self):
+        os.makedirs(self.path)
+        git(self.path, 'init', '-q', '-b', 'main')
+        with open(os.path.join(self.path, 'setup.py'), 'w') as f:
+            f.write(f'version = "{self.dev_version}.0dev"\n')
+        git(self.path, 'add', 'setup.py')
+        git(self.path, 'commit', '-q', '-m', 'initial commit')
+        for version in self.stable_versions:
+            git(self.path, 'branch', f'stable-{version}')
+
+    def commit_pr(self, number):
+        fn = os.path.join(self.path, 'changes', f'pr_{number}.txt')
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, 'w') as f:
+            f.write(f'change for #{number}\n')
+        git(self.path, 'add', fn)
+        git(self.path, 'commit', '-q', '-m', f'Change from PR #{number} (#{number})')
+        return git(self.path, 'rev-parse', 'HEAD')
+
+    def cherry_pick(self, sha, version):
+        git(self.path, 'checkout', '-q', f'stable-{version}')
+        try:
+            git(self.path, 'cherry-pick', '-x', sha)
+            cp_sha = git(self.path, 'rev-parse', 'HEAD')
+        finally:
+            git(self.path, 'checkout', '-q', 'main')
+        self.backports[version].append(cp_sha)
+        return cp_sha
+
+    def commit_message(self, sha):
+        return git(self.path, 'log', '-1', '--format=%B', sha)
+
+    def tag_releases(self, tags_per_branch):
+        for version, shas in self.backports.items():
+            if not shas or not tags_per_branch:
+                continue
+            step = max(1, len(shas) // tags_per_branch)
+            for idx, sha in enumerate(shas[step - 1::step][:tags_per_branch]):
+                git(self.path, 'tag', f'{version}.{idx}', sha)
+
+
+class SyntheticGenerator:
+
+    def __init__(
+        self,
+        root,
+        issues=50,
+        repos=('ansible/galaxy_ng',),
+        stable_branches=3,
+        tags_per_branch=2,
+        backport_ratio=0.7,
+        unmerged_ratio=0.1,
+        seed=0
+    ):
+        self.root = root
+        self.issue_count = issues
+        self.tags_per_branch = tags_per_branch
+        self.backport_ratio = backport_ratio
+        self.unmerged_ratio = unmerged_ratio
+        self.random = random.Random(seed)
+
+        # 4.3 is in the analyzer's ignore list, so start after it
+        self.stable_versions = [f'4.{4 + x}' for x in range(stable_branches)]
+        self.dev_version = f'4.{4 + stable_branches}'
+
+        self.repos = []
+        for full_name in repos:
+            org, name = full_name.split('/', 1)
+            self.repos.append(SyntheticRepo(root, org, name, self.stable_versions, self.dev_version))
+
+        self.fixture = {
+            'pulls': {},
+            'comments': {},
+            'timeline': {},
+            'commits': {},
+            'commit_pulls': {},
+            'branches': {},
+        }
+        self.jira_issues = []
+
+    def pull_raw(self, repo, number, title, branch, merged, merge_commit_sha, labels):
+        return {
+            'url': repo.api_url(f'pulls/{number}'),
+            'html_url': repo.html_url(number),
+            'number': number,
+            'title': title,
+            'user': {'login': self.random.choice(['alice', 'bob', 'carol', 'dave'])},
+            'state': 'closed' if merged else 'open',
+            'merged': merged,
+            'merge_commit_sha': merge_commit_sha,
+            'labels': [{'name': x} for x in labels],
+            'base': {'ref': branch},
+            '_links': {
+                'comments': {'href': repo.api_url(f'issues/{number}/comments')}
+            }
+        }
+
+    def add_commit(self, repo, sha):
+        self.fixture['commits'][f'{repo.full_name}/{sha}'] = {
+            'sha': sha,
+            'commit': {'message': repo.commit_message(sha)}
+        }
+
+    def make_issue(self, inum):
+        repo = self.random.choice(self.repos)
+        number = repo.next_number
+        repo.next_number += 1
+
+        expected = [x for x in self.stable_versions if self.random.random() < 0.5]
+        fix_versions = [{'name': f'{self.dev_version}.0'}]
+        fix_versions += [{'name': f'{x}.{self.random.randint(0, 5)}'} for x in expected]
+
+        merged = self.random.random() >= self.unmerged_ratio
+        merge_sha = repo.commit_pr(number) if merged else None
+        if merge_sha:
+            self.add_commit(repo, merge_sha)
+
+        labels = []
+        comments = []
+        timeline = []
+        for version in expected:
+            labels.append(f'backport-{version}')
+            if not merged or self.random.random() >= self.backport_ratio:
+                continue
+
+            cp_sha = repo.cherry_pick(merge_sha, version)
+            self.add_commit(repo, cp_sha)
+            labels.append(f'backported-{version}')
+
+            bp_number = repo.next_number
+            repo.next_number += 1
+            bp_raw = self.pull_raw(
+                repo,
+                bp_number,
+                f'[PR #{number}/{merge_sha[:8]} backport][stable-{version}] Change from PR #{number}',
+                f'stable-{version}',
+                True,
+                cp_sha,
+                []
+            )
+            self.fixture['pulls'][f'{repo.full_name}/{bp_number}'] = bp_raw
+            self.fixture['commit_pulls'][f'{repo.full_name}/{cp_sha}'] = [
+                {'url': bp_raw['url'], 'html_url': bp_raw['html_url']}
+            ]
+
+            comments.append({
+                'user': {'login': 'patchback[bot]'},
+                'body': f'Backport to stable-{version}: 💚 backport PR created\n\n'
+                        + f'Backported as {repo.html_url(bp_number)}\n'
+            })
+            timeline.append({
+                'event': 'cross-referenced',
+                'source': {'issue': {'html_url': repo.html_url(bp_number)}}
+            })
+            timeline.append({
+                'event': 'referenced',
+                'commit_url': repo.api_url(f'commits/{cp_sha}')
+            })
+
+        title = f'Change from PR #{number}'
+        self.fixture['pulls'][f'{repo.full_name}/{number}'] = self.pull_raw(
+            repo, number, title, 'main', merged, merge_sha, labels
+        )
+        self.fixture['comments'][f'{repo.full_name}/{number}'] = comments
+        self.fixture['timeline'][f'{repo.full_name}/{number}'] = timeline
+
+        key = f'AAH-{inum}'
+        self.jira_issues.append({
+            'id': str(10000 + inum),
+            'key': key,
+            'self': f'{API}/rest/api/2/issue/{key}',
+            'fields': {
+                'summary': title,
+                'status': {'name': self.random.choice(ISSUE_STATES)},
+                'fixVersions': fix_versions,
+                'customfield_12310220': [repo.html_url(number)],
+            }
+        })
+
+    def generate(self):
+        logger.info(f'generate {self.issue_count} issues in {self.root}')
+        for repo in self.repos:
+            repo.init()
+
+        for inum in range(1, self.issue_count + 1):
+            self.make_issue(inum)
+
+        for repo in self.repos:
+            repo.tag_releases(self.tags_per_branch)
+            branches = ['main'] + [f'stable-{x}' for x in self.stable_versions]
+            self.fixture['branches'][repo.full_name] = [{'name': x} for x in branches]
+
+        self.fixture['jira_issues'] = self.jira_issues
+        with open(os.path.join(self.root, 'github.json'), 'w') as f:
+            f.write(json.dumps(self.fixture))
+
+        datadir = os.path.join(self.root, '.data')
+        os.makedirs(datadir, exist_ok=True)
+        with open(os.path.join(datadir, 'jiras.json'), 'w') as f:
+            f.write(json.dumps(self.jira_issues, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root')
+    parser.add_argument('--issues', type=int, default=50)
+    parser.add_argument('--repos', nargs='+', default=['ansible/galaxy_ng'])
+    parser.add_argument('--stable-branches', type=int, default=3)
+    parser.add_argument('--tags-per-branch', type=int, default=2)
+    parser.add_argument('--backport-ratio', type=float, default=0.7)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    SyntheticGenerator(
+        args.root,
+        issues=args.issues,
+        repos=args.repos,
+        stable_branches=args.stable_branches,
+        tags_per_branch=args.tags_per_branch,
+        backport_ratio=args.backport_ratio,
+        seed=args.seed
+    ).generate()
+
+
+if __name__ == "__main__":
+    main()
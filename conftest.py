@@ -0,0 +1 @@
+# lets a plain `pytest` import lib/ and bench/ from the repository root
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+archive.py - record/replay archive for github and jira traffic
+
+The archive is a single append-only file of frames:
+
+    <url length: u32><body length: u32><canonical url><gzipped json record>
+
+The url is stored uncompressed so opening an archive only has to walk the frame
+headers to build the url -> offset index; bodies are decompressed on demand.
+When a url was recorded more than once the last frame wins. A frame cut short
+by an interrupted recording is ignored on replay and dropped before recording
+appends to the archive again.
+"""
+
+import gzip
+import json
+import os
+import struct
+import threading
+
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+from logzero import logger
+
+
+FRAME_HEADER = struct.Struct('>II')
+MODES = ('record', 'replay')
+
+
+def canonical_url(url, params=None):
+    '''Normalize a url so equivalent requests map to the same archive entry'''
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query.extend((k, str(v)) for k, v in params.items())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        path,
+        urlencode(sorted(query)),
+        ''
+    ))
+
+
+class ArchiveMiss(Exception):
+    pass
+
+
+class ArchivedResponse:
+    '''Just enough of requests.Response for the clients'''
+
+    from_cache = False
+
+    def __init__(self, record):
+        self.url = record['url']
+        self.status_code = record['status']
+        self.headers = record.get('headers', {})
+        self.links = record.get('links', {})
+        self.text = record['body']
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class TrafficArchive:
+
+    def __init__(self, filename, mode):
+        if mode not in MODES:
+            raise Exception(f'archive mode must be one of {MODES}')
+        self.filename = filename
+        self.mode = mode
+        self.index = {}
+        self._lock = threading.Lock()
+        self._fh = None
+
+        if self.replaying:
+            if not os.path.exists(filename):
+                raise Exception(f'{filename} does not exist')
+            self._fh = open(filename, 'rb')
+            if self._build_index() < os.path.getsize(filename):
+                logger.warning(f'ignoring an incomplete frame at the end of {filename}')
+            logger.info(f'replaying {len(self.index)} urls from {filename}')
+        else:
+            dirname = os.path.dirname(filename)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._fh = open(filename, 'r+b' if os.path.exists(filename) else 'w+b')
+            end = self._build_index()
+            size = self._fh.seek(0, os.SEEK_END)
+            if end < size:
+                logger.warning(f'dropping {size - end} bytes of an incomplete frame from {filename}')
+                self._fh.truncate(end)
+            self._fh.seek(end)
+            logger.info(f'recording traffic to {filename}')
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def _build_index(self):
+        '''Index every complete frame and return the offset where the last one ends'''
+        size = self._fh.seek(0, os.SEEK_END)
+        offset = 0
+        while True:
+            self._fh.seek(offset)
+            header = self._fh.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            url_len, body_len = FRAME_HEADER.unpack(header)
+            body_offset = offset + FRAME_HEADER.size + url_len
+            if body_offset + body_len > size:
+                break
+            try:
+                url = self._fh.read(url_len).decode('utf-8')
+            except UnicodeDecodeError:
+                break
+            self.index[url] = (body_offset, body_len)
+            offset = body_offset + body_len
+        return offset
+
+    def __contains__(self, url):
+        return canonical_url(url) in self.index
+
+    def get(self, url, params=None):
+        key = canonical_url(url, params=params)
+        if key not in self.index:
+            raise ArchiveMiss(f'{key} is not in {self.filename}')
+        offset, length = self.index[key]
+        with self._lock:
+            self._fh.seek(offset)
+            data = self._fh.read(length)
+        return ArchivedResponse(json.loads(gzip.decompress(data)))
+
+    def record(self, url, status, body, headers=None, links=None, params=None):
+        key = canonical_url(url, params=params)
+        record = {
+            'url': key,
+            'status': status,
+            'headers': headers or {},
+            'links': links or {},
+            'body': body,
+        }
+        data = gzip.compress(json.dumps(record).encode('utf-8'))
+        url_bytes = key.encode('utf-8')
+        with self._lock:
+            offset = self._fh.tell()
+            self._fh.write(FRAME_HEADER.pack(len(url_bytes), len(data)))
+            self._fh.write(url_bytes)
+            self._fh.write(data)
+            self._fh.flush()
+            self.index[key] = (offset + FRAME_HEADER.size + len(url_bytes), len(data))
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+
+def add_archive_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='ARCHIVE', help='record all api traffic to this archive')
+    group.add_argument('--replay', metavar='ARCHIVE', help='serve all api traffic from this archive')
+
+
+def archive_from_args(args):
+    if args.record:
+        return TrafficArchive(args.record, 'record')
+    if args.replay:
+        return TrafficArchive(args.replay, 'replay')
+    return None
@@ -1,13 +1,30 @@
 import argparse
+import contextlib
 import copy
 import json
 import os
+import signal
+import sys
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 from pprint import pprint
 from logzero import logger
 
+from lib.archive import ArchiveMiss
+from lib.archive import add_archive_arguments
+from lib.archive import archive_from_args
+from lib.checkpoint import Budget
+from lib.checkpoint import Checkpoint
+from lib.checkpoint import prioritize_issues
+from lib.config import issue_number
+from lib.config import issue_project
+from lib.config import load_config
+from lib.findings import FindingsStream
 from lib.github_client import GithubClient
+from lib.github_client import RateLimitExceeded
+from lib.profiler import Profiler
 
 
 
@@ -31,6 +48,10 @@ def fixversion_to_backport_name(fv_name):
     return bpv
 
 
+# exit status of a run that was stopped by a budget or rate limit, or had failed issues
+PARTIAL_RUN_EXIT_STATUS = 3
+
+
 class BackportAnalyzer:
 
     jira_issues = None
@@ -41,29 +62,206 @@ class BackportAnalyzer:
     # these weren't real releases
     ignore_fix_versions = ['4.3']
 
-    def __init__(self, issue=None):
+    def __init__(
+        self,
+        issue=None,
+        profiler=None,
+        archive=None,
+        stream=None,
+        process=True,
+        project=None,
+        config=None,
+        gc=None,
+        checkpoint=None,
+        budget=None
+    ):
         self.issue_key = issue
-        self.gc = GithubClient()
-        self.load_jira_issues()
+        self.stream = stream
+        self.checkpoint = checkpoint
+        self.config = config or load_config()
+        self.project = project or self.config.projects[0]
+        self.profiler = profiler or Profiler()
+        # shards for other projects may pass in a shared client
+        self.gc = gc or GithubClient(profiler=self.profiler, archive=archive, config=self.config)
+        self.budget = budget or Budget(self.gc)
+        with self.profiler.stage('load_jira_issues'):
+            self.load_jira_issues()
         self.errors = []
+        self.findings = {}
+        # every issue was evaluated, nothing failed or was left for later
+        self.complete = False
         self.jira_states = set()
-        self.process_jira_issues()
+
+        # reverse indexes so a changed PR or commit maps back to its issues
+        self.pr_index = {}
+        self.commit_index = {}
+        self.issue_refs = {}
+
+        if process:
+            with self.profiler.stage('process_jira_issues'):
+                self.process_jira_issues()
 
     def load_jira_issues(self):
-        logger.info('load all jira issues')
-        with open( os.path.join(self.cachedir, 'jiras.json'), 'r') as f:
+        logger.info(f'load all {self.project.key} jira issues')
+        with open( os.path.join(self.cachedir, self.project.data_file), 'r') as f:
             self.jira_issues = json.loads(f.read())
 
-        self.jira_issues = sorted(self.jira_issues, reverse=True, key=lambda x: int(x['key'].replace('AAH-', '')))
+        self.jira_issues = sorted(self.jira_issues, reverse=True, key=lambda x: issue_number(x['key']))
 
         if self.issue_key:
             self.jira_issues = [x for x in self.jira_issues if x['key'] == self.issue_key]
 
+    @property
+    def issue_map(self):
+        return {x['key']: x for x in self.jira_issues}
+
+    def update_issue(self, issue):
+        '''Add or replace an issue in the in memory issue store'''
+        self.jira_issues = [x for x in self.jira_issues if x['key'] != issue['key']]
+        self.jira_issues.append(issue)
+        self.jira_issues = sorted(self.jira_issues, reverse=True, key=lambda x: issue_number(x['key']))
+
+    def remove_issue(self, ikey):
+        '''Drop a deleted issue from the in memory issue store along with its findings'''
+        self.forget_issue(ikey)
+        self.jira_issues = [x for x in self.jira_issues if x['key'] != ikey]
+
+    def add_finding(self, ikey, rule, pr, message, branch=None):
+        if branch is None:
+            branch = pr.raw.get('base', {}).get('ref')
+        self.errors.append(message)
+        self.findings.setdefault(ikey, []).append({
+            'issue': ikey,
+            'rule': rule,
+            'pr_url': pr.html_url,
+            'author': pr.author,
+            'branch': branch,
+            'message': message,
+        })
+
+    def index_pr(self, ikey, pr_url, merge_commit_sha=None):
+        urls, shas = self.issue_refs.setdefault(ikey, (set(), set()))
+        urls.add(pr_url)
+        self.pr_index.setdefault(pr_url, set()).add(ikey)
+        if merge_commit_sha:
+            shas.add(merge_commit_sha)
+            self.commit_index.setdefault(merge_commit_sha, set()).add(ikey)
+
+    def unindex_issue(self, ikey):
+        urls, shas = self.issue_refs.pop(ikey, (set(), set()))
+        for url in urls:
+            self.pr_index.get(url, set()).discard(ikey)
+        for sha in shas:
+            self.commit_index.get(sha, set()).discard(ikey)
+
+    def forget_issue(self, ikey):
+        self.unindex_issue(ikey)
+        self.errors = [x for x in self.errors if not x.startswith(ikey + ' ')]
+        self.findings.pop(ikey, None)
+
+    def reprocess_jira_issue(self, issue, lock=None):
+        '''Evaluate an issue again and swap in its new findings and index entries
+
+        The evaluation itself runs on a scratch copy without holding lock, only
+        the swap does, so readers never see a half evaluated issue.
+        '''
+        ikey = issue['key']
+        scratch = copy.copy(self)
+        scratch.errors = []
+        scratch.findings = {}
+        scratch.jira_states = set()
+        scratch.pr_index = {}
+        scratch.commit_index = {}
+        scratch.issue_refs = {}
+        with self.profiler.issue(ikey):
+            scratch.process_jira_issue(issue)
+
+        with lock or contextlib.nullcontext():
+            # deleted while it was being evaluated
+            if ikey not in self.issue_map:
+                return []
+            self.forget_issue(ikey)
+            self.errors.extend(scratch.errors)
+            self.jira_states |= scratch.jira_states
+            if ikey in scratch.findings:
+                self.findings[ikey] = scratch.findings[ikey]
+            urls, shas = scratch.issue_refs.get(ikey, (set(), set()))
+            self.issue_refs[ikey] = (urls, shas)
+            for url in urls:
+                self.pr_index.setdefault(url, set()).add(ikey)
+            for sha in shas:
+                self.commit_index.setdefault(sha, set()).add(ikey)
+            return self.findings.get(ikey, [])
+
+    def restore_findings(self, ikey, findings):
+        self.findings[ikey] = findings
+        self.errors.extend(x['message'] for x in findings)
+
     def process_jira_issues(self):
-        for issue in self.jira_issues:
-            self.process_jira_issue(issue)
+        evaluated = 0
+        failed = 0
+        remaining = 0
+        # issues whose findings made it to the stream one way or another
+        handled = set()
+        completed = False
+
+        try:
+            for issue in prioritize_issues(self.jira_issues):
+                ikey = issue['key']
+
+                if self.checkpoint and self.checkpoint.done(ikey):
+                    self.restore_findings(ikey, self.checkpoint.findings(ikey))
+                    if self.stream:
+                        self.stream.emit(ikey, self.findings[ikey])
+                    handled.add(ikey)
+                    continue
 
-        logger.info("--------------- RESULTS ----------------")
+                if self.budget.exhausted():
+                    remaining += 1
+                    continue
+
+                try:
+                    with self.profiler.issue(ikey):
+                        self.process_jira_issue(issue)
+                except RateLimitExceeded as e:
+                    self.budget.stop(str(e))
+                    self.forget_issue(ikey)
+                    remaining += 1
+                    continue
+                except Exception as e:
+                    # leave it out of the checkpoint so a resumed run retries it
+                    logger.exception(e)
+                    logger.error(f'{ikey} could not be evaluated')
+                    self.forget_issue(ikey)
+                    if self.checkpoint:
+                        self.checkpoint.fail(ikey, e)
+                    failed += 1
+                    continue
+
+                evaluated += 1
+                if self.checkpoint:
+                    self.checkpoint.add(ikey, self.findings.get(ikey, []))
+                if self.stream:
+                    self.stream.emit(ikey, self.findings.get(ikey, []))
+                handled.add(ikey)
+            completed = True
+
+        finally:
+            # also reached on KeyboardInterrupt so the work done so far is kept
+            self.complete = completed and not failed and not remaining
+            if self.checkpoint:
+                self.checkpoint.save(complete=self.complete)
+            if self.stream:
+                for issue in self.jira_issues:
+                    if issue['key'] not in handled:
+                        self.stream.carry_forward(issue['key'])
+
+        logger.info(
+            f'{self.project.key}: {evaluated} evaluated, {failed} failed,'
+            + f' {remaining} left for the next run'
+        )
+
+        logger.info(f"--------------- {self.project.key} RESULTS ----------------")
         for error in self.errors:
             logger.error(error)
 
@@ -96,27 +294,33 @@ class BackportAnalyzer:
 
         for pr_url in pr_urls:
 
-            if 'github' not in pr_url:
+            if not self.project.tracks(pr_url):
                 continue
 
-            if 'galaxy_ng' not in pr_url and 'hub-ui' not in pr_url:
-                continue
-
-            if 'importer' in pr_url:
-                continue
+            self.index_pr(ikey, pr_url)
 
             try:
-                pr = self.gc.get_pullrequest(pr_url)
+                with self.profiler.stage('get_pullrequest'):
+                    pr = self.gc.get_pullrequest(pr_url)
+            except (RateLimitExceeded, ArchiveMiss):
+                # the issue has to fail, a replay must not quietly drop findings
+                raise
             except Exception as e:
                 logger.error(f'\tcould not find {pr_url}')
                 continue
 
+            self.index_pr(ikey, pr.html_url, pr.merge_commit_sha)
+
             # find the new PR if this one was deprecated
             swapped = False
             if not pr.merged and pr.closed:
-                slinks = pr.successor_links
+                with self.profiler.stage('successor_links'):
+                    slinks = pr.successor_links
                 if not slinks:
-                    self.errors.append(
+                    self.add_finding(
+                        ikey,
+                        'closed-without-merge',
+                        pr,
                         f'{ikey} links to {pr.html_url} [{pr.author}]'
                         + ' which was closed without merge'
                     )
@@ -125,17 +329,24 @@ class BackportAnalyzer:
                 candidates = []
                 for slink in slinks:
                     _pr = self.gc.get_pullrequest(slink)
+                    self.index_pr(ikey, _pr.html_url, _pr.merge_commit_sha)
                     candidates.append(_pr)
 
                 if len(candidates) > 1:
-                    self.errors.append(
+                    self.add_finding(
+                        ikey,
+                        'multiple-successors',
+                        pr,
                         f'{ikey} links to {pr.html_url} [{pr.author}]'
                         + ' which was closed without merge and has multiple successors'
                     )
                     continue
 
                 new_pr = candidates[0]
-                self.errors.append(
+                self.add_finding(
+                    ikey,
+                    'deprecated-pr',
+                    pr,
                     f'{ikey} links to {pr.html_url} [{pr.author}]'
                     + f' which was deprecated by {new_pr.html_url} [{pr.author}]'
                 )
@@ -144,7 +355,10 @@ class BackportAnalyzer:
 
             done_states = ['done', 'ready for qa', 'in qa']
             if istate in done_states and not pr.merged:
-                self.errors.append(
+                self.add_finding(
+                    ikey,
+                    'done-but-not-merged',
+                    pr,
                     f'{ikey} is marked as "{istate}" when'
                     + f' {pr.html_url} [{pr.author}] is not merged'
                 )
@@ -160,7 +374,8 @@ class BackportAnalyzer:
             backports_missed = [x for x in backports_expected if x not in backport_requests]
 
             # what is the dev version?
-            dev_version = self.gc.get_dev_branch_version(pr.org_name, pr.repo_name)
+            with self.profiler.stage('dev_branch_version'):
+                dev_version = self.gc.get_dev_branch_version(pr.org_name, pr.repo_name)
             dev_version = fixversion_to_backport_name(dev_version)
 
             # what branches did this commit end up in?
@@ -168,7 +383,8 @@ class BackportAnalyzer:
             if pr.merged:
 
                 csha = pr.raw['merge_commit_sha']
-                branches = self.gc.get_commit_branches(pr.org_name, pr.repo_name, csha)
+                with self.profiler.stage('commit_branches'):
+                    branches = self.gc.get_commit_branches(pr.org_name, pr.repo_name, csha)
                 branches = [x.replace('stable-', '') for x in branches if x.startswith('stable-')]
                 branches.append(dev_version)
                 branches = sorted(set(branches))
@@ -183,7 +399,8 @@ class BackportAnalyzer:
                 #    import epdb; epdb.st()
 
                 # What tags is this in?
-                tags = self.gc.get_commit_tags(pr.org_name, pr.repo_name, csha)
+                with self.profiler.stage('commit_tags'):
+                    tags = self.gc.get_commit_tags(pr.org_name, pr.repo_name, csha)
                 tags = [x for x in tags if x[0].isdigit()]
                 if tags:
                     tag_branches = [fixversion_to_backport_name(x) for x in tags]
@@ -208,13 +425,16 @@ class BackportAnalyzer:
             bpmap = {}
 
             # find the backport comments
-            blinks = pr.backport_links
+            with self.profiler.stage('backport_links'):
+                blinks = pr.backport_links
             if pr.branch_name.startswith('stable-'):
                 blinks.append(pr.html_url)
                 blinks = sorted(set(blinks))
 
             for blink in blinks:
-                bp_pr = self.gc.get_pullrequest(blink)
+                with self.profiler.stage('get_pullrequest'):
+                    bp_pr = self.gc.get_pullrequest(blink)
+                self.index_pr(ikey, bp_pr.html_url, bp_pr.merge_commit_sha)
                 bn = bp_pr.branch_name
                 bv = bn.replace('stable-', '')
 
@@ -242,29 +462,174 @@ class BackportAnalyzer:
 
                 if avs not in bpmap:
                     if avs in backports_expected and avs != dev_version:
-                        self.errors.append(
+                        self.add_finding(
+                            ikey,
+                            'missing-backport',
+                            pr,
                             f'{ikey} has a fix version of {avs}'
-                            + f' but no related backport PR for {pr.html_url} [{pr.author}]'
+                            + f' but no related backport PR for {pr.html_url} [{pr.author}]',
+                            branch=f'stable-{avs}'
                         )
                     continue
                 if avs in bpmap and avs not in backports_expected:
                     avs_pr = bpmap[avs][0]['pr']
-                    self.errors.append(
+                    self.add_finding(
+                        ikey,
+                        'unexpected-backport',
+                        avs_pr,
                         f'{ikey} has no fix version for {avs}'
-                        + f' but was backported to {avs} in {avs_pr.html_url}'
+                        + f' but was backported to {avs} in {avs_pr.html_url}',
+                        branch=f'stable-{avs}'
                     )
                 if pr.merged and backports_expected and istate in done_states:
                     merged_backports = [x for x in bpmap[avs] if x['merged']]
                     if not merged_backports:
-                        self.errors.append(
+                        self.add_finding(
+                            ikey,
+                            'unmerged-backport',
+                            pr,
                             f'{ikey} has no merged backports for {pr.html_url} [{pr.author}]'
-                            + f' to {avs} but is in a "done" state'
+                            + f' to {avs} but is in a "done" state',
+                            branch=f'stable-{avs}'
                         )
 
 
 
+def run_shards(
+    config,
+    projects,
+    profiler=None,
+    archive=None,
+    stream=None,
+    issue=None,
+    process=True,
+    max_requests=None,
+    max_seconds=None,
+    checkpoint_interval=None,
+    resume=False
+):
+    '''Analyze every project concurrently, sharing one github client between the shards'''
+    profiler = profiler or Profiler()
+    gc = GithubClient(profiler=profiler, archive=archive, config=config)
+    budget = Budget(gc, max_requests=max_requests, max_seconds=max_seconds)
+
+    if issue:
+        projects = [x for x in projects if x.key == issue_project(issue)]
+        if not projects:
+            raise Exception(f'{issue} does not belong to any configured project')
+
+    def run(project):
+        checkpoint = None
+        if checkpoint_interval:
+            checkpoint = Checkpoint(
+                os.path.join(BackportAnalyzer.cachedir, f'checkpoint_{project.key}.json'),
+                resume=resume,
+                interval=checkpoint_interval
+            )
+        return BackportAnalyzer(
+            issue=issue,
+            profiler=profiler,
+            stream=stream,
+            process=process,
+            project=project,
+            config=config,
+            gc=gc,
+            checkpoint=checkpoint,
+            budget=budget
+        )
+
+    if len(projects) == 1:
+        return [run(projects[0])]
+    def run_in_thread(project):
+        with profiler.thread():
+            return run(project)
+
+    with ThreadPoolExecutor(max_workers=len(projects)) as executor:
+        futures = [executor.submit(run_in_thread, x) for x in projects]
+        try:
+            return [x.result() for x in futures]
+        except KeyboardInterrupt:
+            # the other shards stop between issues and save their checkpoints
+            budget.stop('interrupted')
+            raise
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--issue')
+    parser.add_argument('--config', help='json file with projects and repos, see projects.json.example')
+    parser.add_argument('--project', nargs='+', help='only analyze these project keys')
+    parser.add_argument('--profile', action='store_true', help='collect timings, counters and cache stats')
+    parser.add_argument('--profile-output', default='profile.json', help='where to write the profile json')
+    parser.add_argument('--cprofile', help='also run under cProfile and dump the stats to this file')
+    parser.add_argument(
+        '--findings',
+        help='jsonl file the findings are streamed to, defaults to .data/findings.jsonl'
+        + ' (single issue runs only write findings when this is given)'
+    )
+    parser.add_argument('--diff-against', help='previous findings file to diff against (may be the same as --findings)')
+    parser.add_argument('--diff-output', help='jsonl file for new/resolved findings, defaults to <findings>.diff')
+    parser.add_argument('--resume', action='store_true', help='skip issues finished by an interrupted run')
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=int,
+        default=25,
+        help='save the checkpoint every N issues, 0 disables checkpoints'
+    )
+    parser.add_argument('--max-requests', type=int, help='stop after this many uncached github requests')
+    parser.add_argument('--time-budget', type=int, help='stop after this many seconds')
+    add_archive_arguments(parser)
     args = parser.parse_args()
-    BackportAnalyzer(issue=args.issue)
+
+    # treat SIGTERM like ctrl-c so checkpoints and findings get saved
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # a single issue run should not clobber the full run's findings
+    if args.findings is None and not args.issue:
+        args.findings = os.path.join(BackportAnalyzer.cachedir, 'findings.jsonl')
+    if args.diff_against and not args.findings:
+        parser.error('--diff-against with --issue needs an explicit --findings file')
+
+    config = load_config(args.config)
+    projects = config.get_projects(args.project)
+
+    profiler = Profiler(enabled=args.profile, cprofile_file=args.cprofile)
+    profiler.start()
+    archive = archive_from_args(args)
+    stream = None
+    if args.findings:
+        stream = FindingsStream(
+            args.findings,
+            previous_filename=args.diff_against,
+            diff_filename=args.diff_output
+        )
+    try:
+        analyzers = run_shards(
+            config,
+            projects,
+            profiler=profiler,
+            archive=archive,
+            stream=stream,
+            issue=args.issue,
+            max_requests=args.max_requests,
+            max_seconds=args.time_budget,
+            # a single issue run should not clobber the full run's checkpoint
+            checkpoint_interval=None if args.issue else args.checkpoint_interval,
+            resume=args.resume
+        )
+    finally:
+        if stream:
+            stream.carry_forward_unanalyzed([x.key for x in projects], issue=args.issue)
+            stream.close()
+        profiler.stop()
+        if archive:
+            archive.close()
+        if args.profile:
+            profiler.log_summary()
+            profiler.save(args.profile_output)
+
+    # lets cron jobs tell a partial run from a finished one
+    incomplete = [x.project.key for x in analyzers if not x.complete]
+    if incomplete:
+        logger.error(f'run is incomplete for {incomplete}, see --resume')
+        sys.exit(PARTIAL_RUN_EXIT_STATUS)
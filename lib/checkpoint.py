@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+checkpoint.py - resumable runs with request/time budgets
+
+A Checkpoint remembers which issues of a project were fully evaluated along
+with their findings and is written to disk every few issues. A resumed run
+skips those issues and re-emits their findings. Once a run gets through every
+issue the checkpoint is marked complete and the next --resume starts over.
+
+A Budget is shared by all project shards and stops the run between issues
+once the request or time allowance is used up, or when github reports that
+the rate limit is exhausted.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+
+from logzero import logger
+
+
+# evaluated first, the rest keeps the usual newest-first order
+QA_STATES = ['in qa', 'ready for qa']
+DONE_STATES = ['done', 'closed']
+
+
+def issue_priority(issue):
+    state = issue['fields']['status']['name'].lower()
+    if state in QA_STATES:
+        return 0
+    if state not in DONE_STATES:
+        return 1
+    return 2
+
+
+def prioritize_issues(issues):
+    # sorted() is stable so issues keep their order within a tier
+    return sorted(issues, key=issue_priority)
+
+
+class Checkpoint:
+
+    def __init__(self, filename, resume=False, interval=25):
+        self.filename = filename
+        self.interval = interval
+        self.issues = {}
+        self.failed = {}
+        self.complete = False
+        self._unsaved = 0
+
+        if resume and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                ds = json.loads(f.read())
+            if ds.get('complete'):
+                logger.info(f'{filename} is from a finished run, starting over')
+            else:
+                self.issues = ds['issues']
+                logger.info(f'resuming from {filename} with {len(self.issues)} issues done')
+
+    def done(self, ikey):
+        return ikey in self.issues
+
+    def findings(self, ikey):
+        return self.issues.get(ikey, [])
+
+    def add(self, ikey, findings):
+        self.issues[ikey] = findings
+        self.failed.pop(ikey, None)
+        self._unsaved += 1
+        if self._unsaved >= self.interval:
+            self.save()
+
+    def fail(self, ikey, error):
+        self.failed[ikey] = str(error)
+
+    def save(self, complete=False):
+        self.complete = complete
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            f.write(json.dumps({
+                'updated': datetime.datetime.utcnow().isoformat(),
+                'complete': complete,
+                'issues': self.issues,
+                'failed': self.failed,
+            }))
+        os.replace(tmpfile, self.filename)
+        self._unsaved = 0
+
+
+class Budget:
+
+    def __init__(self, client, max_requests=None, max_seconds=None):
+        self.client = client
+        self.max_requests = max_requests
+        self.deadline = time.time() + max_seconds if max_seconds else None
+        self.reason = None
+        self._lock = threading.Lock()
+
+    def stop(self, reason):
+        with self._lock:
+            if self.reason is None:
+                logger.error(f'stopping: {reason}')
+                self.reason = reason
+
+    def exhausted(self):
+        if self.reason:
+            return True
+        if self.max_requests is not None and self.client.request_count >= self.max_requests:
+            self.stop(f'request budget of {self.max_requests} used up')
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.stop('time budget used up')
+        return self.reason is not None
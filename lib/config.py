@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+config.py - jira projects, tracked repositories and version discovery strategies
+
+A config file is json in the same shape as DEFAULT_CONFIG (see
+projects.json.example). Every project is synced and analyzed as its own shard;
+repositories are shared between projects.
+
+version_strategies are tried in order until one yields a version:
+
+    setup_py      the "version = ..." line of setup.py
+    python_init   the __version__ line of version_file
+    git_describe  git describe --match v* of the checkout
+"""
+
+import json
+import re
+
+from logzero import logger
+
+
+DEFAULT_CONFIG = {
+    'projects': [
+        {
+            'key': 'AAH',
+            'jira_query': 'project = AAH',
+            'data_file': 'jiras.json',
+            'repos': ['ansible/galaxy_ng', 'ansible/ansible-hub-ui'],
+        }
+    ],
+    'repos': {
+        'ansible/galaxy_ng': {
+            'version_strategies': ['setup_py'],
+        },
+        'ansible/ansible-hub-ui': {
+            'version_strategies': ['setup_py', 'python_init'],
+            'version_file': 'ansible-hub-ui/__init__.py',
+        },
+        'ansible/galaxy': {
+            'version_strategies': ['setup_py', 'git_describe'],
+        },
+    }
+}
+
+
+PLAIN_PROJECT_QUERY_RE = re.compile(r'^\s*project\s*=\s*"?([\w-]+)"?\s*$', re.IGNORECASE)
+
+
+def issue_number(key):
+    # AAH-1234 -> 1234
+    return int(key.rsplit('-', 1)[-1])
+
+
+def issue_project(key):
+    # AAH-1234 -> AAH
+    return key.rsplit('-', 1)[0]
+
+
+def repo_name_from_url(url):
+    # https://github.com/ansible/galaxy_ng/pull/1 -> ansible/galaxy_ng
+    if 'github.com' not in url:
+        return None
+    parts = url.split('github.com', 1)[-1].strip('/').split('/')
+    if parts and parts[0] == 'repos':
+        parts = parts[1:]
+    if len(parts) < 2:
+        return None
+    return f'{parts[0]}/{parts[1]}'
+
+
+class RepoConfig:
+
+    def __init__(self, full_name, version_strategies=None, version_file=None):
+        self.full_name = full_name
+        self.org_name, self.repo_name = full_name.split('/', 1)
+        self.version_strategies = version_strategies or ['setup_py']
+        self.version_file = version_file
+
+    def __repr__(self):
+        return f'<RepoConfig {self.full_name}>'
+
+
+class ProjectConfig:
+
+    def __init__(self, key, jira_query=None, data_file=None, repos=None):
+        self.key = key
+        self.jira_query = jira_query or f'project = {key}'
+        self.data_file = data_file or f'jiras_{key}.json'
+        self.repos = repos or []
+
+    def __repr__(self):
+        return f'<ProjectConfig {self.key}>'
+
+    @property
+    def whole_project(self):
+        '''Does jira_query select every issue of the project (no extra filters)?'''
+        match = PLAIN_PROJECT_QUERY_RE.match(self.jira_query)
+        return bool(match) and match.group(1).upper() == self.key.upper()
+
+    def tracks(self, pr_url):
+        '''Is the PR in one of the repositories this project cares about?'''
+        # github owner and repository names are case insensitive
+        full_name = repo_name_from_url(pr_url)
+        return bool(full_name) and full_name.lower() in [x.lower() for x in self.repos]
+
+
+class Config:
+
+    def __init__(self, ds):
+        self.repos = {}
+        for full_name, rds in ds.get('repos', {}).items():
+            self.repos[full_name] = RepoConfig(full_name, **rds)
+
+        self.projects = []
+        for pds in ds['projects']:
+            project = ProjectConfig(**pds)
+            for full_name in project.repos:
+                if full_name not in self.repos:
+                    self.repos[full_name] = RepoConfig(full_name)
+            self.projects.append(project)
+
+    def get_repo(self, org, repo):
+        full_name = f'{org}/{repo}'
+        if full_name not in self.repos:
+            self.repos[full_name] = RepoConfig(full_name)
+        return self.repos[full_name]
+
+    def get_projects(self, keys=None):
+        if not keys:
+            return self.projects[:]
+        projects = [x for x in self.projects if x.key in keys]
+        missing = set(keys) - set(x.key for x in projects)
+        if missing:
+            raise Exception(f'unknown projects: {sorted(missing)}')
+        return projects
+
+
+def load_config(filename=None):
+    if not filename:
+        return Config(DEFAULT_CONFIG)
+    logger.info(f'load config from {filename}')
+    with open(filename, 'r') as f:
+        return Config(json.loads(f.read()))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+daemon.py - keep the analysis hot and re-evaluate issues as webhooks arrive
+
+    POST /github          github pull_request, issue_comment and push webhooks
+    POST /jira            jira issue created, updated and deleted webhooks
+    GET  /findings        current findings for every issue
+    GET  /findings/<key>  current findings for a single issue
+    GET  /status          queue depth and issue counts
+
+Webhook handlers only look up the issues that reference the changed PR or
+commit and queue them after the cache invalidations of the event. A single
+worker thread refreshes checkouts, drops stale cache entries and re-analyzes the
+issues, so reading findings never waits on github or git.
+If GITHUB_WEBHOOK_SECRET is set the X-Hub-Signature-256 header is verified.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from logzero import logger
+
+from lib.backport_analyzer import run_shards
+from lib.config import issue_project
+from lib.config import load_config
+
+
+CHERRY_PICK_RE = re.compile(r'cherry picked from commit ([0-9a-f]{40})')
+
+
+class BackportDaemon:
+
+    def __init__(self, analyzers, host='127.0.0.1', port=8000, secret=None):
+        # one analyzer per project shard, all sharing a single github client
+        self.analyzers = {x.project.key: x for x in analyzers}
+        self.gc = analyzers[0].gc
+        self.secret = secret
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.last_processed = None
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._worker = threading.Thread(target=self._work, daemon=True)
+
+    def serve_forever(self):
+        self._worker.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f'listening for webhooks on http://{host}:{port}')
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def verify_signature(self, body, signature):
+        if not self.secret:
+            return True
+        if not signature:
+            return False
+        expected = 'sha256=' + hmac.new(self.secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def enqueue(self, keys, invalidations=None):
+        '''Queue the cache invalidations of an event, then the issues it affects'''
+        queued = []
+        with self.lock:
+            if any(invalidations.values() if invalidations else []):
+                self.queue.put(('invalidate', invalidations))
+                # issues queued before the invalidation have to be evaluated again after it
+                self.queued.clear()
+            for key in sorted(keys):
+                if key in self.queued:
+                    continue
+                self.queued.add(key)
+                self.queue.put(('issue', key))
+                queued.append(key)
+        return queued
+
+    def _work(self):
+        # the only thread that talks to github/git after startup
+        while True:
+            kind, item = self.queue.get()
+            try:
+                if kind == 'invalidate':
+                    self.invalidate(item)
+                else:
+                    self.reprocess(item)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self.queue.task_done()
+
+    def invalidate(self, invalidations):
+        gc = self.gc
+        for org, repo in sorted(invalidations.get('checkouts', [])):
+            gc.refresh_checkout(org, repo)
+        for org, repo, sha in sorted(invalidations.get('commits', [])):
+            gc.invalidate_commit(org, repo, sha)
+        for html_url in sorted(invalidations.get('pull_requests', [])):
+            gc.invalidate_pullrequest(html_url)
+
+    def reprocess(self, key):
+        with self.lock:
+            self.queued.discard(key)
+            analyzer = self.analyzers.get(issue_project(key))
+            issue = analyzer.issue_map.get(key) if analyzer else None
+        if issue is None:
+            return
+        findings = analyzer.reprocess_jira_issue(issue, lock=self.lock)
+        with self.lock:
+            self.last_processed = time.time()
+        logger.info(f'{key} re-evaluated: {len(findings)} findings')
+        for finding in findings:
+            logger.error(finding['message'])
+
+    def handle_github(self, event, payload):
+        '''Return the issue keys affected by an event and the cache entries it invalidates'''
+        keys = set()
+        invalidations = {'checkouts': set(), 'commits': set(), 'pull_requests': set()}
+
+        if event == 'pull_request':
+            pr = payload['pull_request']
+            invalidations['pull_requests'].add(pr['html_url'])
+            with self.lock:
+                keys |= self.lookup('pr_index', pr['html_url'])
+                if pr.get('merge_commit_sha'):
+                    keys |= self.lookup('commit_index', pr['merge_commit_sha'])
+
+        elif event == 'issue_comment':
+            issue = payload['issue']
+            html_url = issue.get('pull_request', {}).get('html_url') or issue['html_url']
+            html_url = html_url.replace('/issues/', '/pull/')
+            invalidations['pull_requests'].add(html_url)
+            with self.lock:
+                keys |= self.lookup('pr_index', html_url)
+
+        elif event == 'push':
+            org, repo = payload['repository']['full_name'].split('/', 1)
+            shas = set()
+            for commit in payload.get('commits', []):
+                shas.add(commit['id'])
+                shas.update(CHERRY_PICK_RE.findall(commit.get('message', '')))
+            invalidations['checkouts'].add((org, repo))
+            with self.lock:
+                for sha in shas:
+                    invalidations['commits'].add((org, repo, sha))
+                    keys |= self.lookup('commit_index', sha)
+                # the PRs of affected issues get new timeline references
+                for key in keys:
+                    analyzer = self.analyzers[issue_project(key)]
+                    urls, _ = analyzer.issue_refs.get(key, (set(), set()))
+                    invalidations['pull_requests'].update(urls)
+
+        elif event == 'ping':
+            pass
+
+        else:
+            logger.debug(f'ignoring github event {event}')
+
+        return keys, invalidations
+
+    def handle_jira(self, payload):
+        issue = payload.get('issue')
+        if not issue or 'key' not in issue:
+            return set()
+        analyzer = self.analyzers.get(issue_project(issue['key']))
+        if analyzer is None:
+            logger.debug(f"ignoring jira event for untracked {issue['key']}")
+            return set()
+        if payload.get('webhookEvent') == 'jira:issue_deleted':
+            with self.lock:
+                analyzer.remove_issue(issue['key'])
+            logger.info(f"{issue['key']} was deleted")
+            return set()
+        with self.lock:
+            # the daemon can not evaluate jql, so a filtered project only
+            # follows the issues its last sync matched
+            if not analyzer.project.whole_project and issue['key'] not in analyzer.issue_map:
+                logger.debug(f"ignoring jira event for {issue['key']}, not matched by {analyzer.project.jira_query}")
+                return set()
+            analyzer.update_issue(issue)
+        return {issue['key']}
+
+    def lookup(self, index_name, value):
+        '''Union of the issue keys every shard has indexed for a PR url or commit'''
+        keys = set()
+        for analyzer in self.analyzers.values():
+            keys |= getattr(analyzer, index_name).get(value, set())
+        return keys
+
+    def findings(self, key=None):
+        with self.lock:
+            if key:
+                analyzer = self.analyzers.get(issue_project(key))
+                return {key: analyzer.findings.get(key, []) if analyzer else []}
+            findings = {}
+            for analyzer in self.analyzers.values():
+                findings.update({k: v for k, v in analyzer.findings.items() if v})
+            return findings
+
+    def status(self):
+        with self.lock:
+            return {
+                'projects': {
+                    key: {
+                        'issues': len(analyzer.jira_issues),
+                        'issues_with_findings': len([x for x in analyzer.findings.values() if x]),
+                    }
+                    for key, analyzer in self.analyzers.items()
+                },
+                'queued': len(self.queued),
+                'last_processed': self.last_processed,
+            }
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, indent=2).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts == ['findings']:
+                    return self._send(200, daemon.findings())
+                if len(parts) == 2 and parts[0] == 'findings':
+                    return self._send(200, daemon.findings(parts[1]))
+                if parts == ['status']:
+                    return self._send(200, daemon.status())
+                self._send(404, {'message': 'Not Found'})
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    return self._send(400, {'message': 'bad Content-Length'})
+                body = self.rfile.read(length)
+
+                try:
+                    if self.path.rstrip('/') == '/github':
+                        if not daemon.verify_signature(body, self.headers.get('X-Hub-Signature-256')):
+                            return self._send(401, {'message': 'bad signature'})
+                        event = self.headers.get('X-GitHub-Event', '')
+                        keys, invalidations = daemon.handle_github(event, json.loads(body))
+                    elif self.path.rstrip('/') == '/jira':
+                        keys, invalidations = daemon.handle_jira(json.loads(body)), None
+                    else:
+                        return self._send(404, {'message': 'Not Found'})
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    # malformed json or a payload without the fields the event needs
+                    logger.error(f'{self.path} bad payload: {e!r}')
+                    return self._send(400, {'message': f'bad payload: {e!r}'})
+
+                queued = daemon.enqueue(keys, invalidations)
+                logger.info(f'{self.path} queued {queued}')
+                self._send(202, {'queued': queued})
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--config', help='json file with projects and repos, see projects.json.example')
+    parser.add_argument('--project', nargs='+', help='only track these project keys')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    analyzers = run_shards(config, config.get_projects(args.project))
+    daemon = BackportDaemon(
+        analyzers,
+        host=args.host,
+        port=args.port,
+        secret=os.environ.get('GITHUB_WEBHOOK_SECRET')
+    )
+    daemon.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
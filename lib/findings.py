@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+findings.py - stream findings as jsonl and diff them against a previous run
+
+Every evaluated issue is written as soon as it is done, one json record per
+finding:
+
+    {"issue": "AAH-1", "rule": "missing-backport", "pr_url": "...",
+     "author": "...", "branch": "stable-4.5", "message": "..."}
+
+When a previous findings file is given, the records of each evaluated issue are
+merged against that issue's previous records and "new"/"resolved" records are
+streamed to the diff file. Only the byte offsets of the previous file are kept
+in memory, never the previous report itself.
+
+Issues a run does not get to (budget, rate limit, errors) and issues of
+projects that are not part of the run (--project, --issue) have their previous
+records carried forward unchanged, so a partial run never looks like it
+resolved or newly found anything for them.
+"""
+
+import json
+import os
+import threading
+
+from logzero import logger
+
+from lib.config import issue_project
+
+
+def fingerprint(finding):
+    return (finding['rule'], finding['pr_url'] or '', finding['branch'] or '')
+
+
+class PreviousFindings:
+    '''Index of a previous findings file by issue key -> line offsets'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets = {}
+        self._fh = None
+
+        if not os.path.exists(filename):
+            logger.warning(f'{filename} does not exist, every finding will be new')
+            return
+
+        self._fh = open(filename, 'rb')
+        offset = 0
+        for line in self._fh:
+            if line.strip():
+                # only the key is needed for the index
+                try:
+                    ikey = json.loads(line)['issue']
+                except (ValueError, KeyError, TypeError):
+                    # a run killed mid write leaves a partial last line
+                    logger.warning(f'{filename} has an unreadable record at offset {offset}, ignoring the rest')
+                    break
+                self.offsets.setdefault(ikey, []).append(offset)
+            offset += len(line)
+
+    def get(self, ikey):
+        findings = []
+        for offset in self.offsets.get(ikey, []):
+            self._fh.seek(offset)
+            findings.append(json.loads(self._fh.readline()))
+        return findings
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+
+
+class FindingsStream:
+
+    def __init__(self, filename, previous_filename=None, diff_filename=None):
+        self.filename = filename
+        self.previous = None
+        self.diff_fh = None
+        self.counts = {'findings': 0, 'new': 0, 'resolved': 0, 'carried': 0}
+        self._lock = threading.Lock()
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        diff = bool(previous_filename)
+        if not diff and os.path.exists(filename):
+            # still needed to carry skipped issues forward
+            previous_filename = filename
+
+        if previous_filename:
+            self.previous = PreviousFindings(previous_filename)
+            same_file = os.path.abspath(previous_filename) == os.path.abspath(filename)
+            if same_file and os.path.exists(filename):
+                # keep the last run around instead of truncating it, only
+                # once it was indexed so a bad file is never moved aside
+                rotated = filename + '.prev'
+                os.replace(filename, rotated)
+                self.previous.filename = rotated
+        if diff:
+            self.diff_fh = open(diff_filename or filename + '.diff', 'w')
+
+        self.fh = open(filename, 'w')
+
+    def emit(self, ikey, findings):
+        # project shards share one stream
+        with self._lock:
+            self._emit(ikey, findings)
+
+    def carry_forward(self, ikey):
+        '''Copy the previous records of an issue that was not evaluated this run'''
+        with self._lock:
+            if self.previous is None:
+                return
+            findings = self.previous.get(ikey)
+            self._write(findings)
+            self.counts['carried'] += len(findings)
+
+    def carry_forward_unanalyzed(self, project_keys, issue=None):
+        '''Carry forward every previous issue outside of the projects (or single issue) of this run'''
+        if self.previous is None:
+            return
+        for ikey in sorted(self.previous.offsets):
+            if issue:
+                outside = ikey != issue
+            else:
+                outside = issue_project(ikey) not in project_keys
+            if outside:
+                self.carry_forward(ikey)
+
+    def _write(self, findings):
+        for finding in findings:
+            self.fh.write(json.dumps(finding, sort_keys=True) + '\n')
+        self.counts['findings'] += len(findings)
+        self.fh.flush()
+
+    def _emit(self, ikey, findings):
+        self._write(findings)
+
+        if self.diff_fh is None:
+            return
+
+        current = {fingerprint(x): x for x in findings}
+        previous = {fingerprint(x): x for x in self.previous.get(ikey)}
+        for fp in sorted(set(current) | set(previous)):
+            if fp in current and fp in previous:
+                continue
+            change = 'new' if fp in current else 'resolved'
+            record = dict(current.get(fp) or previous[fp])
+            record['change'] = change
+            self.diff_fh.write(json.dumps(record, sort_keys=True) + '\n')
+            self.counts[change] += 1
+        self.diff_fh.flush()
+
+    def close(self):
+        self.fh.close()
+        if self.previous is not None:
+            self.previous.close()
+        if self.diff_fh is not None:
+            self.diff_fh.close()
+            logger.info(
+                f"{self.counts['findings']} findings, {self.counts['new']} new,"
+                + f" {self.counts['resolved']} resolved, {self.counts['carried']} carried forward"
+            )
@@ -5,23 +5,48 @@ import os
 import requests
 import requests_cache
 import subprocess
+import threading
+import time
 from logzero import logger
 
+from lib.config import load_config
+from lib.profiler import Profiler
+
 
 requests_cache.install_cache('github_cache')
 
+# overridable so the analyzer can be pointed at a local stand-in (see bench/)
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+GITHUB_CLONE_URL = os.environ.get('GITHUB_CLONE_URL', 'https://github.com').rstrip('/')
+CHECKOUTS_DIR = os.environ.get('CHECKOUTS_DIR', '/tmp/checkouts')
+
+
+class RateLimitExceeded(Exception):
+    pass
+
 
 def convert_html_url_to_api_url(html_url):
     # https://github.com/ansible/galaxy_ng/pull/1370
     # https://api.github.com/repos/OWNER/REPO/issues
-    if 'api.github.com' in html_url:
+    if 'api.github.com' in html_url or html_url.startswith(GITHUB_API_URL):
         return html_url
 
-    api_url = html_url.replace('github.com', 'api.github.com/repos')
+    path = html_url.split('github.com', 1)[-1]
+    api_url = GITHUB_API_URL + '/repos' + path
     api_url = api_url.replace('/pull/', '/pulls/')
     return api_url
 
 
+def endpoint_class(api_url):
+    # https://api.github.com/repos/ansible/galaxy_ng/pulls/1370 -> pulls
+    # https://api.github.com/repos/ansible/galaxy_ng/commits/abc/pulls -> commits/pulls
+    path = api_url.split('?')[0].split('/')[3:]
+    if path and path[0] == 'repos':
+        path = path[3:]
+    names = [x for x in path if not x.isdigit() and len(x) != 40]
+    return '/'.join(names) or 'root'
+
+
 def repo_url_from_html_url(html_url):
     # https://github.com/ansible/galaxy_ng/pull/1
     #   to
@@ -38,7 +63,7 @@ class GithubRepo:
 
     @property
     def branch_names(self):
-        api_url = f'https://api.github.com/repos/{self.org_name}/{self.repo_name}/branches'
+        api_url = f'{GITHUB_API_URL}/repos/{self.org_name}/{self.repo_name}/branches'
         ds = self._client.get(api_url)
         return [x['name'] for x in ds]
 
@@ -105,7 +130,7 @@ class GithubPullRequest:
         """
 
         mc_sha = self.merge_commit_sha
-        mc_url = f'https://api.github.com/repos/{self.org_name}/{self.repo_name}/commits/{mc_sha}'
+        mc_url = f'{GITHUB_API_URL}/repos/{self.org_name}/{self.repo_name}/commits/{mc_sha}'
         mc_ds = self._client.get(mc_url)
 
         # https://stackoverflow.com/a/16782303
@@ -116,7 +141,7 @@ class GithubPullRequest:
 
         found = []
         for rb in repo_branches:
-            bcurl = f'https://api.github.com/repos/{self.org_name}/{self.repo_name}/commits?sha={rb}'
+            bcurl = f'{GITHUB_API_URL}/repos/{self.org_name}/{self.repo_name}/commits?sha={rb}'
             logger.debug(f'paginate {bcurl}')
             branch_commits = self._client.paginated_get(bcurl)
             branch_shas = [x['sha'] for x in branch_commits]
@@ -133,7 +158,7 @@ class GithubPullRequest:
     @property
     def branch_name(self):
         if 'base' not in self.raw:
-            import epdb; epdb.st()
+            raise Exception(f'{self.html_url} has no base branch: {self.raw.get("message")}')
         return self.raw['base']['ref']
 
     @property
@@ -267,11 +292,41 @@ class GithubClient:
 
     checkouts = None
 
-    def __init__(self):
+    def __init__(self, profiler=None, archive=None, config=None):
+        self.archive = archive
+        self.config = config or load_config()
         self.token = os.environ.get('GITHUB_TOKEN')
-        if self.token is None:
+        if self.token is None and not (archive and archive.replaying):
             raise Exception('GITHUB_TOKEN must be exported!')
         self.checkouts = {}
+        self.profiler = profiler or Profiler()
+
+        # in memory indexes, dropped by invalidate_pullrequest/refresh_checkout
+        self.pullrequests = {}
+        self.dev_versions = {}
+        self.tag_maps = {}
+
+        # the client is shared between project shards, so anything that
+        # touches a checkout is serialized per repository
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._url_locks = {}
+
+        # requests that actually went over the network, for budgets
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    def repo_lock(self, org, repo):
+        with self._locks_lock:
+            if (org, repo) not in self._locks:
+                self._locks[(org, repo)] = threading.RLock()
+            return self._locks[(org, repo)]
+
+    def url_lock(self, api_url):
+        with self._locks_lock:
+            if api_url not in self._url_locks:
+                self._url_locks[api_url] = threading.Lock()
+            return self._url_locks[api_url]
 
     @property
     def headers(self):
@@ -279,17 +334,70 @@ class GithubClient:
             'Authorization': f'token {self.token}'
         }
 
-    def get(self, api_url):
+    def _request(self, api_url):
         # logger.info(f'GET {api_url}')
-        rr = requests.get(api_url, headers=self.headers)
+        if self.archive and self.archive.replaying:
+            with self.profiler.stage('archive_replay'):
+                rr = self.archive.get(api_url)
+            self._check_rate_limit(api_url, rr)
+            return rr
+
+        # concurrent shards asking for the same url wait for the first
+        # request and then get the response from the requests cache
+        with self.url_lock(api_url):
+            started = time.time()
+            rr = requests.get(api_url, headers=self.headers)
+            elapsed = time.time() - started
+
+        if self.archive:
+            self.archive.record(
+                api_url,
+                rr.status_code,
+                rr.text,
+                headers={k: v for k, v in rr.headers.items() if k.lower().startswith('x-ratelimit')},
+                links=rr.links
+            )
+
+        from_cache = getattr(rr, 'from_cache', False)
+        self.profiler.record_cache('http', from_cache)
+        if not from_cache:
+            with self._count_lock:
+                self.request_count += 1
+            self.profiler.record_http(endpoint_class(api_url), rr.status_code, elapsed)
+            remaining = rr.headers.get('X-RateLimit-Remaining')
+            if remaining is not None:
+                self.profiler.set_gauge('github_ratelimit_remaining', int(remaining))
+
+        self._check_rate_limit(api_url, rr)
+        return rr
+
+    def _check_rate_limit(self, api_url, rr):
+        if rr.status_code not in (403, 429):
+            return
+        if rr.headers.get('X-RateLimit-Remaining') == '0' or 'rate limit' in rr.text.lower():
+            reset = rr.headers.get('X-RateLimit-Reset')
+            raise RateLimitExceeded(f'rate limited on {api_url} (resets at {reset})')
+
+    def _run(self, cmd, cwd=None, stdout=None):
+        started = time.time()
+        pid = subprocess.run(cmd, shell=True, cwd=cwd, stdout=stdout)
+        name = ' '.join(cmd.split()[:2])
+        self.profiler.record_subprocess(name, time.time() - started)
+        return pid
+
+    def get(self, api_url):
+        rr = self._request(api_url)
         return rr.json()
 
     def paginated_get(self, next_url):
         data = []
         while next_url:
             # logger.debug(f'GET {next_url}')
-            rr = requests.get(next_url, headers=self.headers)
+            rr = self._request(next_url)
             ds = rr.json()
+            if not isinstance(ds, list):
+                logger.error(f'unexpected response from {next_url}: {ds}')
+                break
             data.extend(ds)
 
             if not rr.links:
@@ -305,63 +413,130 @@ class GithubClient:
     def _convert_html_url_to_api_url(self, html_url):
         # https://github.com/ansible/galaxy_ng/pull/1370
         # https://api.github.com/repos/OWNER/REPO/issues
-        if 'api.github.com' in html_url:
+        if 'api.github.com' in html_url or html_url.startswith(GITHUB_API_URL):
             return html_url
 
-        api_url = html_url.replace('github.com', 'api.github.com/repos')
+        path = html_url.split('github.com', 1)[-1]
+        api_url = GITHUB_API_URL + '/repos' + path
         return api_url
 
     def get_pullrequest(self, issue_url):
         api_url = convert_html_url_to_api_url(issue_url)
-        ds = self.get(api_url)
-        if ds.get('message') == 'Not Found':
+        if api_url in self.pullrequests:
+            return self.pullrequests[api_url]
+        rr = self._request(api_url)
+        try:
+            ds = rr.json()
+        except ValueError:
+            ds = {}
+        if not isinstance(ds, dict):
+            ds = {}
+        if rr.status_code == 404 or ds.get('message') == 'Not Found':
             raise Exception(f'PR not found {api_url}')
-        return GithubPullRequest(ds, client=self)
+        # error bodies (401, 5xx, abuse limits) must not end up in the registry
+        if rr.status_code != 200 or 'base' not in ds:
+            raise Exception(f'could not fetch PR {api_url}: {rr.status_code} {ds.get("message", "")}')
+        pr = GithubPullRequest(ds, client=self)
+        self.pullrequests[api_url] = pr
+        return pr
+
+    def invalidate(self, api_url):
+        '''Drop a url, and any cached pages that follow it, from the requests cache'''
+        cache = requests_cache.get_cache()
+        while api_url and cache.has_url(api_url):
+            rr = requests.get(api_url, headers=self.headers)
+            cache.delete_url(api_url)
+            api_url = rr.links.get('next', {}).get('url')
+
+    def invalidate_pullrequest(self, html_url):
+        '''Forget everything cached about a PR so the next lookup is fresh'''
+        api_url = convert_html_url_to_api_url(html_url)
+        self.pullrequests.pop(api_url, None)
+        issue_url = api_url.replace('/pulls/', '/issues/')
+        for url in [api_url, issue_url + '/comments', issue_url + '/timeline']:
+            self.invalidate(url)
+
+    def invalidate_commit(self, org, repo, commit):
+        base_url = f'{GITHUB_API_URL}/repos/{org}/{repo}/commits/{commit}'
+        self.invalidate(base_url)
+        self.invalidate(base_url + '/pulls')
+
+    def refresh_checkout(self, org, repo):
+        '''Fetch new commits/tags and drop the indexes built from the checkout'''
+        with self.repo_lock(org, repo):
+            self.dev_versions.pop((org, repo), None)
+            self.tag_maps.pop((org, repo), None)
+            checkout_dir = os.path.join(CHECKOUTS_DIR, f'{org}.{repo}')
+            tag_map_fn = os.path.join(CHECKOUTS_DIR, f'{org}_{repo}_tag_commit_map.json')
+            if os.path.exists(tag_map_fn):
+                os.remove(tag_map_fn)
+            if not os.path.exists(checkout_dir):
+                return
+            self._run('git fetch --tags --prune origin', cwd=checkout_dir)
+            self._run('git reset --hard origin/HEAD', cwd=checkout_dir)
 
     def get_dev_branch_version(self, org, repo):
+        with self.repo_lock(org, repo):
+            if (org, repo) not in self.dev_versions:
+                self.dev_versions[(org, repo)] = self._get_dev_branch_version(org, repo)
+            return self.dev_versions[(org, repo)]
+
+    def _get_dev_branch_version(self, org, repo):
         checkout_dir = self.make_checkout(org, repo)
-        setup_fn = os.path.join(checkout_dir, 'setup.py')
-        if os.path.exists(setup_fn):
-            with open(setup_fn, 'r') as f:
-                fdata = f.read()
-            flines = fdata.split('\n')
-            flines = [x for x in flines if x.startswith('version =')]
-            if flines:
-                version = flines[0].split()[-1]
-                version = version.replace('"', '')
-                version = version.replace("'", '')
+        repo_config = self.config.get_repo(org, repo)
+        for strategy in repo_config.version_strategies:
+            func = getattr(self, f'_version_from_{strategy}', None)
+            if func is None:
+                raise Exception(f'unknown version strategy {strategy} for {repo_config.full_name}')
+            version = func(checkout_dir, repo_config)
+            if version:
                 return version
 
-        if repo == 'ansible-hub-ui':
-            setup_fn = os.path.join(checkout_dir, 'ansible-hub-ui', '__init__.py')
-            with open(setup_fn, 'r') as f:
-                fdata = f.read()
-            flines = fdata.split('\n')
-            flines = [x for x in flines if '__version__' in x]
-            if flines:
-                version = flines[0].split()[-1]
-                version = version.replace('"', '')
-                version = version.replace("'", '')
-                return version
+        raise Exception(f'could not determine the dev version of {repo_config.full_name}')
 
-        if repo == 'galaxy':
-            pid = subprocess.run(
-                'git describe --always --match v*',
-                shell=True,
-                cwd=checkout_dir,
-                stdout=subprocess.PIPE
-            )
-            version = pid.stdout.decode('utf-8').strip()
-            if '-' in version:
-                chunks = version.lstrip('v').rsplit('-', 2)
-                return '{0}.dev{1}+{2}'.format(*chunks)
-
-            if '.' in version:
-                return version.lstrip('v')
-
-            return '0.0.0.dev0+{0}'.format('v')
-
-        import epdb; epdb.st()
+    def _version_from_setup_py(self, checkout_dir, repo_config):
+        setup_fn = os.path.join(checkout_dir, 'setup.py')
+        if not os.path.exists(setup_fn):
+            return None
+        with open(setup_fn, 'r') as f:
+            fdata = f.read()
+        flines = fdata.split('\n')
+        flines = [x for x in flines if x.startswith('version =')]
+        if flines:
+            version = flines[0].split()[-1]
+            version = version.replace('"', '')
+            version = version.replace("'", '')
+            return version
+
+    def _version_from_python_init(self, checkout_dir, repo_config):
+        setup_fn = os.path.join(checkout_dir, repo_config.version_file)
+        if not os.path.exists(setup_fn):
+            return None
+        with open(setup_fn, 'r') as f:
+            fdata = f.read()
+        flines = fdata.split('\n')
+        flines = [x for x in flines if '__version__' in x]
+        if flines:
+            version = flines[0].split()[-1]
+            version = version.replace('"', '')
+            version = version.replace("'", '')
+            return version
+
+    def _version_from_git_describe(self, checkout_dir, repo_config):
+        pid = self._run(
+            'git describe --always --match v*',
+            cwd=checkout_dir,
+            stdout=subprocess.PIPE
+        )
+        version = pid.stdout.decode('utf-8').strip()
+        if '-' in version:
+            chunks = version.lstrip('v').rsplit('-', 2)
+            return '{0}.dev{1}+{2}'.format(*chunks)
+
+        if '.' in version:
+            return version.lstrip('v')
+
+        return '0.0.0.dev0+{0}'.format('v')
 
     def get_commit_branches(self, org, repo, commit):
         # api_url = f'https://api.github.com/repos/{org}/{repo}/commits/{commit}'
@@ -369,7 +544,7 @@ class GithubClient:
 
         checkout_dir = self.make_checkout(org, repo)
         cmd = f'git branch -a --contains {commit}'
-        pid = subprocess.run(cmd, shell=True, cwd=checkout_dir, stdout=subprocess.PIPE)
+        pid = self._run(cmd, cwd=checkout_dir, stdout=subprocess.PIPE)
         branches = pid.stdout.decode('utf-8')
         branches = branches.split('\n')
         branches = [x.strip() for x in branches]
@@ -383,14 +558,21 @@ class GithubClient:
         # api_url = f'https://api.github.com/repos/{org}/{repo}/commits/{commit}'
         # ds = self.get(api_url)
 
+        with self.repo_lock(org, repo):
+            if (org, repo) not in self.tag_maps:
+                self.tag_maps[(org, repo)] = self._load_tag_commit_map(org, repo)
+        return self.tag_maps[(org, repo)].get(commit, [])
+
+    def _load_tag_commit_map(self, org, repo):
         checkout_dir = self.make_checkout(org, repo)
         fn = os.path.dirname(checkout_dir)
         fn = os.path.join(fn, f'{org}_{repo}_tag_commit_map.json')
+        self.profiler.record_cache('tag_commit_map', os.path.exists(fn))
         if os.path.exists(fn):
             with open(fn, 'r') as f:
                 commit_map = json.loads(f.read())
         else:
-            pid = subprocess.run('git tag -l', shell=True, cwd=checkout_dir, stdout=subprocess.PIPE)
+            pid = self._run('git tag -l', cwd=checkout_dir, stdout=subprocess.PIPE)
             tag_names = pid.stdout.decode('utf-8').split('\n')
             tag_names = [x.strip() for x in tag_names if x.strip()]
 
@@ -398,7 +580,7 @@ class GithubClient:
             for tn in tag_names:
                 cmd = f'git log {tn} --format="%H %s"'
                 logger.debug(cmd)
-                pid = subprocess.run(cmd, shell=True, cwd=checkout_dir, stdout=subprocess.PIPE)
+                pid = self._run(cmd, cwd=checkout_dir, stdout=subprocess.PIPE)
                 if pid.returncode != 0:
                     continue
                 loglines = pid.stdout.decode('utf-8').split('\n')
@@ -412,16 +594,23 @@ class GithubClient:
             with open(fn, 'w') as f:
                 f.write(json.dumps(commit_map))
 
-        return commit_map.get(commit, [])
+        return commit_map
 
     def make_checkout(self, org, repo):
-        tdir = '/tmp/checkouts'
+        tdir = CHECKOUTS_DIR
         if not os.path.exists(tdir):
-            os.makedirs(tdir)
+            os.makedirs(tdir, exist_ok=True)
         checkout_dir = os.path.join(tdir, f'{org}.{repo}')
-        if not os.path.exists(checkout_dir):
-            clone_url = f'https://github.com/{org}/{repo}'
-            cmd = f'git clone {clone_url} {checkout_dir}'
-            subprocess.run(cmd, shell=True)
-        self.checkouts[(org, repo)] = checkout_dir
+        with self.repo_lock(org, repo):
+            self.profiler.record_cache('checkout', os.path.exists(checkout_dir))
+            if not os.path.exists(checkout_dir):
+                if self.archive and self.archive.replaying:
+                    raise Exception(
+                        f'checkout missing: {checkout_dir} has to exist to replay {self.archive.filename},'
+                        + ' replay never clones'
+                    )
+                clone_url = f'{GITHUB_CLONE_URL}/{org}/{repo}'
+                cmd = f'git clone {clone_url} {checkout_dir}'
+                self._run(cmd)
+            self.checkouts[(org, repo)] = checkout_dir
         return checkout_dir
@@ -11,16 +11,26 @@ selenium to navigate through the pages and to input the data.
 import copy
 import glob
 import json
+import argparse
 import os
 import time
 import jira
 
+from concurrent.futures import ThreadPoolExecutor
+
 from pprint import pprint
 from logzero import logger
 
+from lib.archive import add_archive_arguments
+from lib.archive import archive_from_args
+from lib.config import issue_number
+from lib.config import load_config
+from lib.profiler import Profiler
+
 
 DATA_DIR = 'data'
 WAIT_SECONDS = 60
+JIRA_SERVER = os.environ.get('JIRA_SERVER', 'https://issues.redhat.com')
 
 
 class JiraWrapper:
@@ -31,27 +41,76 @@ class JiraWrapper:
     cachedir = '.data'
     driver = None
 
-    def __init__(self):
-
-        jira_token = os.environ.get('JIRA_TOKEN')
-        if not jira_token:
-            raise Exception('JIRA_TOKEN must be set!')
-        logger.info('start jira client')
-        self.jira_client = jira.JIRA(
-            {'server': 'https://issues.redhat.com'},
-            token_auth=jira_token
-        )
+    def __init__(self, profiler=None, archive=None, project=None):
+
+        self.project = project or load_config().projects[0]
+        self.profiler = profiler or Profiler()
+        self.archive = archive
+
+        if self.archive and self.archive.replaying:
+            logger.info(f'replay jira traffic from {self.archive.filename}')
+            self.jira_client = None
+        else:
+            jira_token = os.environ.get('JIRA_TOKEN')
+            if not jira_token:
+                raise Exception('JIRA_TOKEN must be set!')
+            logger.info('start jira client')
+            self.jira_client = jira.JIRA(
+                {'server': JIRA_SERVER},
+                token_auth=jira_token
+            )
 
         logger.info('scrape jira issues')
-        self.scrape_jira_issues()
+        with self.profiler.stage('scrape_jira_issues'):
+            self.scrape_jira_issues()
 
         logger.info('save jira issues to disk')
-        self.save_data()
+        with self.profiler.stage('save_data'):
+            self.save_data()
+
+    def _search_issues(self, query, maxResults):
+        '''Run a jql search and return the raw issue dicts'''
+        url = f'{JIRA_SERVER}/rest/api/2/search'
+        params = {'jql': query, 'maxResults': maxResults}
+        if self.archive and self.archive.replaying:
+            return self.archive.get(url, params=params).json()
+
+        started = time.time()
+        issues = [x.raw for x in self.jira_client.search_issues(query, maxResults=maxResults)]
+        self.profiler.record_http('jira/search', 200, time.time() - started)
+
+        if self.archive:
+            self.archive.record(url, 200, json.dumps(issues), params=params)
+        return issues
+
+    def _get_issue(self, key):
+        '''Fetch a single issue and return the raw dict'''
+        url = f'{JIRA_SERVER}/rest/api/2/issue/{key}'
+        if self.archive and self.archive.replaying:
+            rr = self.archive.get(url)
+            if rr.status_code != 200:
+                raise Exception(f'{key} returned {rr.status_code}: {rr.text}')
+            return rr.json()
+
+        started = time.time()
+        try:
+            issue = self.jira_client.issue(key).raw
+        except Exception as e:
+            status = getattr(e, 'status_code', None) or 'error'
+            self.profiler.record_http('jira/issue', status, time.time() - started)
+            if self.archive:
+                self.archive.record(url, status, str(e))
+            raise
+        self.profiler.record_http('jira/issue', 200, time.time() - started)
+
+        if self.archive:
+            self.archive.record(url, 200, json.dumps(issue))
+        return issue
 
     def save_data(self):
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
-        jfile = os.path.join(self.cachedir, 'jiras.json')
+        jfile = os.path.join(self.cachedir, self.project.data_file)
         with open(jfile, 'w') as f:
             f.write(json.dumps(self.jira_issues, indent=2))
 
@@ -60,21 +119,21 @@ class JiraWrapper:
         imap = {}
         for issue in self.jira_issues:
             key = issue['key']
-            number = int(key.replace('AAH-', ''))
+            number = issue_number(key)
             imap[number] = issue
         return imap
 
     def scrape_jira_issues(self, github_issue_to_find=None):
 
         def run_search_and_populate_issues(query, maxResults):
-            issues = self.jira_client.search_issues(query, maxResults=maxResults)
+            issues = self._search_issues(query, maxResults)
             for issue in issues:
-                inum = int(issue.key.replace('AAH-', ''))
+                inum = issue_number(issue['key'])
                 if inum in self.issue_map:
                     continue
-                logger.info(f'{issue.key} {issue.fields.summary}')
+                logger.info(f"{issue['key']} {issue['fields']['summary']}")
                 try:
-                    self.jira_issues.append(issue.raw)
+                    self.jira_issues.append(issue)
                 except Exception as e:
                     logger.exception(e)
                     continue
@@ -82,22 +141,29 @@ class JiraWrapper:
 
         self.jira_issues = []
 
-        qs = 'project = AAH ORDER BY created DESC'
+        newest_qs = f'{self.project.jira_query} ORDER BY created DESC'
+        oldest_qs = f'{self.project.jira_query} ORDER BY created ASC'
 
         logger.info('get the newest ticket number')
-        issues = self.jira_client.search_issues(qs, maxResults=1)
-        latest = issues[0].key
-        latest_number = int(latest.replace('AAH-', ''))
+        issues = self._search_issues(newest_qs, 1)
+        latest = issues[0]['key']
+        latest_number = issue_number(latest)
 
         logger.info('get the latest 1000')
-        run_search_and_populate_issues(qs, 1000)
+        run_search_and_populate_issues(newest_qs, 1000)
 
         #ikeys = sorted([x for x in list(self.issue_map.keys())])
         #oldest = ikeys[0]
         #import epdb; epdb.st()
 
         logger.info('get the first 1000')
-        run_search_and_populate_issues(qs.replace('DESC', 'ASC'), 1000)
+        run_search_and_populate_issues(oldest_qs, 1000)
+
+        # numbers missing from a filtered query are usually filtered out on
+        # purpose, fetching them one by one would bypass the filter
+        if not self.project.whole_project:
+            logger.info(f'{self.project.key} uses a filtered query, not filling in missing numbers')
+            return
 
         logger.info('get the missing numbers')
         imap = self.issue_map
@@ -106,20 +172,45 @@ class JiraWrapper:
 
         failed = []
         for x in unfetched:
-            key = f'AAH-{x}'
+            key = f'{self.project.key}-{x}'
             logger.info(f'get {key}')
             try:
-                issue = self.jira_client.issue(key)
-                self.jira_issues.append(issue.raw)
+                issue = self._get_issue(key)
+                self.jira_issues.append(issue)
             except Exception as e:
                 logger.exception(e)
                 failed.append(key)
                 continue
-        logger.error(f'total failures: {len(failed)}')
+        logger.error(f'{self.project.key} total failures: {len(failed)}')
 
 
 def main():
-    jw = JiraWrapper()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store_true', help='collect timings and request counters')
+    parser.add_argument('--profile-output', default='jira_profile.json', help='where to write the profile json')
+    parser.add_argument('--config', help='json file with projects and repos, see projects.json.example')
+    parser.add_argument('--project', nargs='+', help='only sync these project keys')
+    add_archive_arguments(parser)
+    args = parser.parse_args()
+
+    projects = load_config(args.config).get_projects(args.project)
+
+    profiler = Profiler(enabled=args.profile)
+    profiler.start()
+    archive = archive_from_args(args)
+
+    def sync(project):
+        return JiraWrapper(profiler=profiler, archive=archive, project=project)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(projects)) as executor:
+            list(executor.map(sync, projects))
+    finally:
+        if archive:
+            archive.close()
+    if args.profile:
+        profiler.log_summary()
+        profiler.save(args.profile_output)
 
 
 if __name__ == "__main__":
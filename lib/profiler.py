@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+profiler.py - lightweight instrumentation for the backport analyzer
+
+Collects wall time per stage and per issue, http requests per endpoint class
+(status codes + latency histograms), the remaining github rate limit,
+subprocess counts/durations and cache hits/misses per cache layer.
+
+Everything is a no-op unless the profiler was created with enabled=True.
+"""
+
+import cProfile
+import json
+import pstats
+import threading
+import time
+
+from contextlib import contextmanager
+from logzero import logger
+
+
+# upper bounds in seconds for the latency histogram buckets
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def _bucket_name(elapsed):
+    for bound in LATENCY_BUCKETS:
+        if elapsed <= bound:
+            return f'<={bound}'
+    return f'>{LATENCY_BUCKETS[-1]}'
+
+
+def _new_timer():
+    return {'count': 0, 'total': 0.0, 'max': 0.0}
+
+
+def _add_time(timer, elapsed):
+    timer['count'] += 1
+    timer['total'] += elapsed
+    timer['max'] = max(timer['max'], elapsed)
+
+
+class Profiler:
+
+    enabled = False
+
+    def __init__(self, enabled=False, cprofile_file=None):
+        self.enabled = enabled
+        self.cprofile_file = cprofile_file
+        self._cprofile = None
+        self._thread_profiles = []
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.issues = {}
+        self.http = {}
+        self.gauges = {}
+        self.subprocesses = {}
+        self.caches = {}
+
+    def start(self):
+        self.started = time.time()
+        if self.cprofile_file:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is None:
+            return
+        self._cprofile.disable()
+        stats = pstats.Stats(self._cprofile)
+        for profile in self._thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(self.cprofile_file)
+        logger.info(f'wrote cProfile stats to {self.cprofile_file}')
+        self._cprofile = None
+        self._thread_profiles = []
+
+    @contextmanager
+    def thread(self):
+        '''Extend --cprofile to a worker thread, cProfile only sees the thread that enabled it'''
+        if self._cprofile is None:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # newer pythons allow a single active profiler
+            logger.warning(f'not profiling {threading.current_thread().name}: {e}')
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._thread_profiles.append(profile)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                _add_time(self.stages.setdefault(name, _new_timer()), elapsed)
+
+    @contextmanager
+    def issue(self, key):
+        if not self.enabled:
+            yield
+            return
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                self.issues[key] = self.issues.get(key, 0.0) + elapsed
+
+    def record_http(self, endpoint, status, elapsed):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.http.setdefault(endpoint, {
+                'count': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'statuses': {},
+                'latency': {},
+            })
+            _add_time(stats, elapsed)
+            status = str(status)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            bucket = _bucket_name(elapsed)
+            stats['latency'][bucket] = stats['latency'].get(bucket, 0) + 1
+
+    def record_subprocess(self, name, elapsed):
+        if not self.enabled:
+            return
+        with self._lock:
+            _add_time(self.subprocesses.setdefault(name, _new_timer()), elapsed)
+
+    def record_cache(self, layer, hit):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.caches.setdefault(layer, {'hits': 0, 'misses': 0})
+            stats['hits' if hit else 'misses'] += 1
+
+    def set_gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def to_dict(self):
+        with self._lock:
+            caches = {}
+            for layer, stats in self.caches.items():
+                lookups = stats['hits'] + stats['misses']
+                caches[layer] = dict(stats)
+                caches[layer]['hit_ratio'] = stats['hits'] / lookups if lookups else None
+            return {
+                'wall_time': time.time() - self.started,
+                'stages': self.stages,
+                'issues': self.issues,
+                'http': self.http,
+                'gauges': self.gauges,
+                'subprocesses': self.subprocesses,
+                'caches': caches,
+            }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            f.write(json.dumps(self.to_dict(), indent=2, sort_keys=True))
+        logger.info(f'wrote profile data to {filename}')
+
+    def log_summary(self, slowest=10):
+        ds = self.to_dict()
+
+        logger.info("--------------- PROFILE ----------------")
+        logger.info(f"wall time: {ds['wall_time']:.2f}s")
+
+        logger.info(f"{'stage':<30} {'count':>7} {'total':>10} {'max':>8}")
+        for name, stats in sorted(ds['stages'].items(), key=lambda x: -x[1]['total']):
+            logger.info(f"{name:<30} {stats['count']:>7} {stats['total']:>10.2f} {stats['max']:>8.2f}")
+
+        logger.info(f"{'endpoint':<30} {'count':>7} {'total':>10} {'max':>8}  statuses")
+        for name, stats in sorted(ds['http'].items(), key=lambda x: -x[1]['total']):
+            statuses = ' '.join(f'{k}:{v}' for k, v in sorted(stats['statuses'].items()))
+            logger.info(
+                f"{name:<30} {stats['count']:>7} {stats['total']:>10.2f} {stats['max']:>8.2f}  {statuses}"
+            )
+
+        logger.info(f"{'subprocess':<30} {'count':>7} {'total':>10} {'max':>8}")
+        for name, stats in sorted(ds['subprocesses'].items(), key=lambda x: -x[1]['total']):
+            logger.info(f"{name:<30} {stats['count']:>7} {stats['total']:>10.2f} {stats['max']:>8.2f}")
+
+        logger.info(f"{'cache':<30} {'hits':>7} {'misses':>10} {'ratio':>8}")
+        for name, stats in sorted(ds['caches'].items()):
+            ratio = '-' if stats['hit_ratio'] is None else f"{stats['hit_ratio']:.2f}"
+            logger.info(f"{name:<30} {stats['hits']:>7} {stats['misses']:>10} {ratio:>8}")
+
+        for name, value in sorted(ds['gauges'].items()):
+            logger.info(f'{name}: {value}')
+
+        if ds['issues']:
+            logger.info(f'slowest {slowest} issues:')
+            for key, elapsed in sorted(ds['issues'].items(), key=lambda x: -x[1])[:slowest]:
+                logger.info(f'\t{key} {elapsed:.2f}s')
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+
+def pytest_configure(config):
+    # lib.github_client installs the requests cache in the working directory
+    # when it is imported, keep it out of the checkout
+    os.chdir(tempfile.mkdtemp(prefix='backport-analyzer-tests-'))
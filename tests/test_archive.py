@@ -0,0 +1,109 @@
+import json
+import os
+
+import pytest
+
+from lib import github_client
+from lib.archive import ArchiveMiss
+from lib.archive import TrafficArchive
+from lib.backport_analyzer import BackportAnalyzer
+from lib.checkpoint import Checkpoint
+
+
+def record(filename, *frames):
+    archive = TrafficArchive(filename, 'record')
+    for url, body, params in frames:
+        archive.record(url, 200, body, headers={'X-Test': '1'}, links={'next': {'url': url}}, params=params)
+    archive.close()
+
+
+def replay(filename):
+    return TrafficArchive(filename, 'replay')
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'traffic.arc')
+    record(
+        filename,
+        ('https://api.github.com/repos/a/b/pulls/1', '{"number": 1}', None),
+        ('https://jira.example.com/rest/api/2/search', '[]', {'maxResults': 1000, 'jql': 'project = AAH'}),
+    )
+
+    archive = replay(filename)
+    rr = archive.get('https://API.github.com/repos/a/b/pulls/1/')
+    assert rr.status_code == 200
+    assert rr.json() == {'number': 1}
+    assert rr.headers == {'X-Test': '1'}
+    assert rr.links == {'next': {'url': 'https://api.github.com/repos/a/b/pulls/1'}}
+    # params are part of the key regardless of their order
+    rr = archive.get('https://jira.example.com/rest/api/2/search', params={'jql': 'project = AAH', 'maxResults': 1000})
+    assert rr.json() == []
+    with pytest.raises(ArchiveMiss):
+        archive.get('https://api.github.com/repos/a/b/pulls/2')
+    archive.close()
+
+
+def test_last_frame_wins(tmp_path):
+    filename = str(tmp_path / 'traffic.arc')
+    url = 'https://api.github.com/repos/a/b/pulls/1'
+    record(filename, (url, '"old"', None))
+    record(filename, (url, '"new"', None))
+
+    archive = replay(filename)
+    assert archive.get(url).json() == 'new'
+    archive.close()
+
+
+def test_truncated_last_frame(tmp_path):
+    filename = str(tmp_path / 'traffic.arc')
+    first = 'https://api.github.com/repos/a/b/pulls/1'
+    second = 'https://api.github.com/repos/a/b/pulls/2'
+    record(filename, (first, '"first"', None), (second, '"second"', None))
+    with open(filename, 'r+b') as f:
+        f.truncate(os.path.getsize(filename) - 5)
+
+    archive = replay(filename)
+    assert first in archive
+    assert second not in archive
+    archive.close()
+
+    # recording drops the partial frame before appending
+    record(filename, (second, '"again"', None))
+    archive = replay(filename)
+    assert archive.get(first).json() == 'first'
+    assert archive.get(second).json() == 'again'
+    archive.close()
+
+
+def empty_archive(tmp_path):
+    filename = str(tmp_path / 'traffic.arc')
+    TrafficArchive(filename, 'record').close()
+    return TrafficArchive(filename, 'replay')
+
+
+def test_replay_never_clones(tmp_path, monkeypatch):
+    monkeypatch.setattr(github_client, 'CHECKOUTS_DIR', str(tmp_path / 'checkouts'))
+    gc = github_client.GithubClient(archive=empty_archive(tmp_path))
+    with pytest.raises(Exception, match='checkout missing'):
+        gc.make_checkout('ansible', 'galaxy_ng')
+    assert not os.path.exists(tmp_path / 'checkouts' / 'ansible.galaxy_ng')
+
+
+def test_replay_miss_fails_the_issue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('.data')
+    with open(os.path.join('.data', 'jiras.json'), 'w') as f:
+        f.write(json.dumps([{
+            'key': 'AAH-1',
+            'fields': {
+                'status': {'name': 'Done'},
+                'fixVersions': [{'name': '4.5.0'}],
+                'customfield_12310220': ['https://github.com/ansible/galaxy_ng/pull/1'],
+            }
+        }]))
+
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+    analyzer = BackportAnalyzer(archive=empty_archive(tmp_path), process=False, checkpoint=checkpoint)
+    analyzer.process_jira_issues()
+    assert 'AAH-1' in checkpoint.failed
+    assert not checkpoint.done('AAH-1')
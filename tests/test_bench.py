@@ -0,0 +1,56 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+from bench.fake_services import FakeServices
+from bench.run_benchmarks import BenchmarkRunner
+
+
+PARAMS = {
+    'issues': 10,
+    'repos': ['ansible/galaxy_ng'],
+    'stable_branches': 2,
+    'tags_per_branch': 1,
+    'backport_ratio': 0.7,
+    'seed': 0,
+}
+
+
+def test_scenarios(tmp_path):
+    runner = BenchmarkRunner(str(tmp_path), PARAMS)
+    try:
+        runner.setup()
+        results = {x: runner.run_scenario(x) for x in ['cold', 'warm', 'single', 'jira_sync']}
+    finally:
+        runner.teardown()
+
+    for name, ds in results.items():
+        assert ds['returncode'] == 0, name
+        assert ds['profile'], name
+    assert results['cold']['requests_served'] > 0
+    # the warm run is served from the requests cache
+    assert results['warm']['requests_served'] < results['cold']['requests_served']
+
+
+def test_fake_services_rate_limit(tmp_path):
+    runner = BenchmarkRunner(str(tmp_path), dict(PARAMS, issues=2))
+    runner.setup()
+    runner.teardown()
+
+    services = FakeServices(str(tmp_path / 'github.json'), ratelimit=1)
+    services.start()
+    try:
+        url = f'{services.base_url}/repos/ansible/galaxy_ng/branches'
+        with urllib.request.urlopen(url) as resp:
+            assert resp.headers['X-RateLimit-Remaining'] == '0'
+            assert [x['name'] for x in json.loads(resp.read())][0] == 'main'
+        try:
+            urllib.request.urlopen(url)
+            assert False, 'expected a 403'
+        except urllib.error.HTTPError as e:
+            assert e.code == 403
+            assert 'rate limit' in json.loads(e.read())['message']
+    finally:
+        services.stop()
+    assert os.path.exists(tmp_path / '.data' / 'jiras.json')
@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+
+from lib.archive import TrafficArchive
+from lib.backport_analyzer import BackportAnalyzer
+from lib.checkpoint import Budget
+from lib.checkpoint import Checkpoint
+from lib.checkpoint import prioritize_issues
+
+
+def issue(ikey, state):
+    return {'key': ikey, 'fields': {'status': {'name': state}}}
+
+
+def read_checkpoint(filename):
+    with open(filename, 'r') as f:
+        return json.loads(f.read())
+
+
+class FakeClient:
+    request_count = 0
+
+
+def test_prioritize_issues():
+    issues = [
+        issue('AAH-6', 'Closed'),
+        issue('AAH-5', 'New'),
+        issue('AAH-4', 'In QA'),
+        issue('AAH-3', 'Done'),
+        issue('AAH-2', 'In Progress'),
+        issue('AAH-1', 'Ready for QA'),
+    ]
+    # QA first, then open, then done, keeping the order within each tier
+    assert [x['key'] for x in prioritize_issues(issues)] == ['AAH-4', 'AAH-1', 'AAH-5', 'AAH-2', 'AAH-6', 'AAH-3']
+
+
+def test_checkpoint_resume(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    checkpoint = Checkpoint(filename, interval=2)
+    checkpoint.add('AAH-1', [{'issue': 'AAH-1'}])
+    assert not os.path.exists(filename)
+    checkpoint.add('AAH-2', [])
+    # saved every interval issues
+    assert set(read_checkpoint(filename)['issues']) == {'AAH-1', 'AAH-2'}
+    checkpoint.fail('AAH-3', Exception('boom'))
+    checkpoint.save()
+
+    resumed = Checkpoint(filename, resume=True)
+    assert resumed.done('AAH-1')
+    assert resumed.findings('AAH-1') == [{'issue': 'AAH-1'}]
+    assert not resumed.done('AAH-3')
+    assert read_checkpoint(filename)['failed'] == {'AAH-3': 'boom'}
+
+    # without --resume the checkpoint is ignored
+    assert not Checkpoint(filename).done('AAH-1')
+
+
+def test_complete_checkpoint_starts_over(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    checkpoint = Checkpoint(filename)
+    checkpoint.add('AAH-1', [])
+    checkpoint.save(complete=True)
+    assert not Checkpoint(filename, resume=True).done('AAH-1')
+
+
+def test_budget_requests():
+    client = FakeClient()
+    budget = Budget(client, max_requests=10)
+    assert not budget.exhausted()
+    client.request_count = 10
+    assert budget.exhausted()
+    assert 'request budget' in budget.reason
+    # stays stopped
+    client.request_count = 0
+    assert budget.exhausted()
+
+
+def test_budget_time():
+    budget = Budget(FakeClient(), max_seconds=1)
+    assert not budget.exhausted()
+    budget.deadline -= 2
+    assert budget.exhausted()
+    assert budget.reason == 'time budget used up'
+
+
+def test_budget_stop_keeps_first_reason():
+    budget = Budget(FakeClient())
+    assert not budget.exhausted()
+    budget.stop('rate limited')
+    budget.stop('time budget used up')
+    assert budget.exhausted()
+    assert budget.reason == 'rate limited'
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    # issues without fix versions are evaluated without any github traffic
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('.data')
+    with open(os.path.join('.data', 'jiras.json'), 'w') as f:
+        f.write(json.dumps([issue(f'AAH-{x}', 'New') for x in range(1, 6)]))
+    archive = str(tmp_path / 'traffic.arc')
+    TrafficArchive(archive, 'record').close()
+
+    def make(**kwargs):
+        checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), **kwargs)
+        return BackportAnalyzer(archive=TrafficArchive(archive, 'replay'), process=False, checkpoint=checkpoint)
+    return make
+
+
+def test_interrupted_run_saves_checkpoint(analyzer, monkeypatch):
+    first = analyzer()
+    process_jira_issue = BackportAnalyzer.process_jira_issue
+
+    def interrupt(self, issue):
+        if issue['key'] == 'AAH-3':
+            raise KeyboardInterrupt()
+        return process_jira_issue(self, issue)
+
+    monkeypatch.setattr(BackportAnalyzer, 'process_jira_issue', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        first.process_jira_issues()
+    ds = read_checkpoint(first.checkpoint.filename)
+    assert ds['complete'] is False
+    assert sorted(ds['issues']) == ['AAH-4', 'AAH-5']
+
+    monkeypatch.setattr(BackportAnalyzer, 'process_jira_issue', process_jira_issue)
+    resumed = analyzer(resume=True)
+    resumed.process_jira_issues()
+    ds = read_checkpoint(resumed.checkpoint.filename)
+    assert ds['complete'] is True
+    assert sorted(ds['issues']) == ['AAH-1', 'AAH-2', 'AAH-3', 'AAH-4', 'AAH-5']
+    assert resumed.complete
+
+
+def test_budget_leaves_checkpoint_incomplete(analyzer):
+    shard = analyzer()
+    shard.budget.stop('rate limited')
+    shard.process_jira_issues()
+    ds = read_checkpoint(shard.checkpoint.filename)
+    assert ds['complete'] is False
+    assert ds['issues'] == {}
+    # the cli exits with PARTIAL_RUN_EXIT_STATUS
+    assert not shard.complete
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from lib.config import Config
+from lib.config import DEFAULT_CONFIG
+from lib.config import ProjectConfig
+from lib.config import issue_number
+from lib.config import issue_project
+from lib.config import load_config
+from lib.config import repo_name_from_url
+
+
+def test_issue_keys():
+    assert issue_number('AAH-1234') == 1234
+    assert issue_project('AAH-1234') == 'AAH'
+    assert issue_number('MY-PROJ-7') == 7
+    assert issue_project('MY-PROJ-7') == 'MY-PROJ'
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('https://github.com/ansible/galaxy_ng/pull/1', 'ansible/galaxy_ng'),
+    ('https://api.github.com/repos/ansible/galaxy_ng/pulls/1', 'ansible/galaxy_ng'),
+    ('https://github.com/ansible', None),
+    ('https://gitlab.com/ansible/galaxy_ng/pull/1', None),
+])
+def test_repo_name_from_url(url, expected):
+    assert repo_name_from_url(url) == expected
+
+
+@pytest.mark.parametrize('jira_query,expected', [
+    (None, True),
+    ('project = AAH', True),
+    ('PROJECT = "AAH"', True),
+    ('project = AAP', False),
+    ('project = AAH AND component = "Automation Hub"', False),
+])
+def test_whole_project(jira_query, expected):
+    assert ProjectConfig('AAH', jira_query).whole_project is expected
+
+
+def test_tracks():
+    project = ProjectConfig('AAH', repos=['ansible/galaxy_ng'])
+    assert project.tracks('https://github.com/ansible/galaxy_ng/pull/1')
+    assert project.tracks('https://github.com/Ansible/Galaxy_NG/pull/1')
+    assert ProjectConfig('AAH', repos=['Ansible/galaxy_ng']).tracks('https://github.com/ansible/galaxy_ng/pull/1')
+    assert not project.tracks('https://github.com/ansible/ansible-hub-ui/pull/1')
+    assert not project.tracks('https://issues.redhat.com/browse/AAH-1')
+
+
+def test_default_config():
+    config = load_config()
+    assert [x.key for x in config.projects] == ['AAH']
+    assert config.projects[0].data_file == DEFAULT_CONFIG['projects'][0]['data_file']
+    repo = config.get_repo('ansible', 'ansible-hub-ui')
+    assert repo.version_strategies == ['setup_py', 'python_init']
+    # unknown repositories get the default strategy
+    assert config.get_repo('ansible', 'other').version_strategies == ['setup_py']
+
+
+def test_load_config(tmp_path):
+    filename = str(tmp_path / 'projects.json')
+    with open(filename, 'w') as f:
+        f.write(json.dumps({
+            'projects': [
+                {'key': 'AAH', 'repos': ['ansible/galaxy_ng']},
+                {'key': 'AAP', 'jira_query': 'project = AAP AND component = "Automation Hub"'},
+            ]
+        }))
+    config = load_config(filename)
+    assert config.projects[0].data_file == 'jiras_AAH.json'
+    assert 'ansible/galaxy_ng' in config.repos
+    assert [x.key for x in config.get_projects(['AAP'])] == ['AAP']
+    with pytest.raises(Exception, match='unknown projects'):
+        config.get_projects(['NOPE'])
+    assert isinstance(config, Config)
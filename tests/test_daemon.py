@@ -0,0 +1,194 @@
+import copy
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from bench.fake_services import FakeServices
+from bench.synthetic import SyntheticGenerator
+from lib import github_client
+from lib.backport_analyzer import run_shards
+from lib.config import ProjectConfig
+from lib.config import load_config
+from lib.daemon import BackportDaemon
+
+
+@pytest.fixture(scope='module')
+def daemon(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('daemon'))
+    SyntheticGenerator(root, issues=20, stable_branches=2).generate()
+    services = FakeServices(os.path.join(root, 'github.json'))
+    services.start()
+
+    settings = {
+        'GITHUB_API_URL': services.base_url,
+        'GITHUB_CLONE_URL': os.path.join(root, 'repos'),
+        'CHECKOUTS_DIR': os.path.join(root, 'checkouts'),
+    }
+    saved_token = os.environ.get('GITHUB_TOKEN')
+    saved_settings = {k: getattr(github_client, k) for k in settings}
+    saved_cwd = os.getcwd()
+    os.environ['GITHUB_TOKEN'] = 'test'
+    # read from the environment at import time, which may already have happened
+    for k, v in settings.items():
+        setattr(github_client, k, v)
+    os.chdir(root)
+
+    config = load_config()
+    backport_daemon = BackportDaemon(run_shards(config, config.projects), port=0)
+    thread = threading.Thread(target=backport_daemon.serve_forever, daemon=True)
+    thread.start()
+    yield backport_daemon
+
+    backport_daemon.shutdown()
+    services.stop()
+    os.chdir(saved_cwd)
+    for k, v in saved_settings.items():
+        setattr(github_client, k, v)
+    if saved_token is None:
+        os.environ.pop('GITHUB_TOKEN', None)
+    else:
+        os.environ['GITHUB_TOKEN'] = saved_token
+
+
+def request(daemon, method, path, payload=None, event=None):
+    host, port = daemon.server.server_address[:2]
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(
+        f'http://{host}:{port}{path}',
+        data=data if method == 'POST' else None,
+        headers={'X-GitHub-Event': event or ''},
+        method=method
+    )
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def findings(daemon, key):
+    status, ds = request(daemon, 'GET', f'/findings/{key}')
+    assert status == 200
+    return sorted(ds[key], key=lambda x: json.dumps(x, sort_keys=True))
+
+
+def analyzer(daemon):
+    return daemon.analyzers['AAH']
+
+
+def issue_with_findings(daemon, skip=()):
+    return sorted(k for k, v in analyzer(daemon).findings.items() if v and k not in skip)[0]
+
+
+def test_pull_request_event(daemon):
+    key = issue_with_findings(daemon)
+    before = findings(daemon, key)
+    pr_url = sorted(analyzer(daemon).issue_refs[key][0])[0]
+
+    status, ds = request(
+        daemon,
+        'POST',
+        '/github',
+        {'action': 'edited', 'pull_request': {'html_url': pr_url, 'merge_commit_sha': None}},
+        event='pull_request'
+    )
+    assert status == 202
+    assert key in ds['queued']
+    daemon.queue.join()
+    # nothing changed upstream, so a re-evaluation ends up where the full run did
+    assert findings(daemon, key) == before
+
+
+def test_push_event(daemon):
+    commit_index = analyzer(daemon).commit_index
+    sha = sorted(x for x in commit_index if commit_index[x])[0]
+    keys = sorted(commit_index[sha])
+
+    status, ds = request(
+        daemon,
+        'POST',
+        '/github',
+        {'repository': {'full_name': 'ansible/galaxy_ng'}, 'commits': [{'id': sha, 'message': 'x'}]},
+        event='push'
+    )
+    assert status == 202
+    assert ds['queued'] == keys
+    daemon.queue.join()
+    assert request(daemon, 'GET', '/status')[1]['last_processed'] is not None
+
+
+def test_jira_events(daemon):
+    key = issue_with_findings(daemon)
+    before = findings(daemon, key)
+    issue = copy.deepcopy(analyzer(daemon).issue_map[key])
+
+    status, ds = request(daemon, 'POST', '/jira', {'webhookEvent': 'jira:issue_updated', 'issue': issue})
+    assert status == 202
+    assert ds['queued'] == [key]
+    daemon.queue.join()
+    assert findings(daemon, key) == before
+
+    issue_count = request(daemon, 'GET', '/status')[1]['projects']['AAH']['issues']
+    status, ds = request(daemon, 'POST', '/jira', {'webhookEvent': 'jira:issue_deleted', 'issue': issue})
+    assert status == 202
+    assert ds['queued'] == []
+    assert findings(daemon, key) == []
+    assert request(daemon, 'GET', '/status')[1]['projects']['AAH']['issues'] == issue_count - 1
+    assert not any(key in x for x in analyzer(daemon).pr_index.values())
+
+
+@pytest.mark.parametrize('path,payload,event', [
+    ('/github', b'not json', 'push'),
+    ('/github', {}, 'pull_request'),
+    ('/github', {'repository': {}}, 'push'),
+    ('/jira', [], None),
+])
+def test_malformed_payload(daemon, path, payload, event):
+    status, ds = request(daemon, 'POST', path, payload, event=event)
+    assert status == 400
+    assert ds['message'].startswith('bad payload')
+
+
+def test_jira_event_for_filtered_project(daemon):
+    shard = analyzer(daemon)
+    project = shard.project
+    shard.project = ProjectConfig('AAH', 'project = AAH AND component = "Automation Hub"', repos=project.repos)
+    try:
+        key = sorted(shard.issue_map)[0]
+        issue = copy.deepcopy(shard.issue_map[key])
+        unmatched = dict(copy.deepcopy(issue), key='AAH-999')
+
+        status, ds = request(daemon, 'POST', '/jira', {'webhookEvent': 'jira:issue_updated', 'issue': unmatched})
+        assert status == 202
+        assert ds['queued'] == []
+        assert 'AAH-999' not in shard.issue_map
+
+        status, ds = request(daemon, 'POST', '/jira', {'webhookEvent': 'jira:issue_updated', 'issue': issue})
+        assert ds['queued'] == [key]
+        daemon.queue.join()
+    finally:
+        shard.project = project
+
+
+def test_delete_during_reprocess(daemon, monkeypatch):
+    shard = analyzer(daemon)
+    key = issue_with_findings(daemon)
+    issue = copy.deepcopy(shard.issue_map[key])
+    process_jira_issue = type(shard).process_jira_issue
+
+    def delete_midway(self, issue):
+        # the webhook lands while the worker evaluates the scratch copy
+        status, ds = request(daemon, 'POST', '/jira', {'webhookEvent': 'jira:issue_deleted', 'issue': issue})
+        assert status == 202
+        return process_jira_issue(self, issue)
+
+    monkeypatch.setattr(type(shard), 'process_jira_issue', delete_midway)
+    assert shard.reprocess_jira_issue(issue, lock=daemon.lock) == []
+    assert key not in shard.issue_map
+    assert key not in shard.findings
+    assert key not in shard.issue_refs
+    assert not any(key in x for x in shard.pr_index.values())
@@ -0,0 +1,116 @@
+import json
+import os
+
+from lib.findings import FindingsStream
+
+
+def finding(ikey, rule, number, branch=None):
+    return {
+        'issue': ikey,
+        'rule': rule,
+        'pr_url': f'https://github.com/ansible/galaxy_ng/pull/{number}',
+        'author': 'alice',
+        'branch': branch,
+        'message': f'{ikey} {rule} {number}',
+    }
+
+
+def read_jsonl(filename):
+    with open(filename, 'r') as f:
+        return [json.loads(x) for x in f if x.strip()]
+
+
+def run(filename, emitted, previous_filename=None, carried=()):
+    stream = FindingsStream(filename, previous_filename=previous_filename)
+    for ikey, findings in emitted.items():
+        stream.emit(ikey, findings)
+    for ikey in carried:
+        stream.carry_forward(ikey)
+    stream.close()
+    return stream
+
+
+def test_diff_reports_new_and_resolved(tmp_path):
+    filename = str(tmp_path / 'findings.jsonl')
+    fixed = finding('AAH-1', 'missing-backport', 1, 'stable-4.4')
+    kept = finding('AAH-1', 'missing-backport', 1, 'stable-4.5')
+    added = finding('AAH-2', 'closed-without-merge', 2)
+
+    run(filename, {'AAH-1': [fixed, kept], 'AAH-2': []})
+    stream = run(filename, {'AAH-1': [kept], 'AAH-2': [added]}, previous_filename=filename)
+
+    assert read_jsonl(filename) == [kept, added]
+    assert read_jsonl(filename + '.prev') == [fixed, kept]
+    diff = read_jsonl(filename + '.diff')
+    assert diff == [dict(fixed, change='resolved'), dict(added, change='new')]
+    assert stream.counts['new'] == 1
+    assert stream.counts['resolved'] == 1
+
+
+def test_missing_previous_file(tmp_path):
+    filename = str(tmp_path / 'out' / 'findings.jsonl')
+    new = finding('AAH-1', 'missing-backport', 1, 'stable-4.4')
+
+    stream = run(filename, {'AAH-1': [new]}, previous_filename=str(tmp_path / 'nope.jsonl'), carried=['AAH-2'])
+    assert os.path.exists(filename)
+    assert read_jsonl(filename + '.diff') == [dict(new, change='new')]
+    assert stream.counts['carried'] == 0
+
+
+def test_partial_last_line(tmp_path):
+    filename = str(tmp_path / 'findings.jsonl')
+    first = finding('AAH-1', 'missing-backport', 1, 'stable-4.4')
+    second = finding('AAH-2', 'closed-without-merge', 2)
+
+    run(filename, {'AAH-1': [first], 'AAH-2': [second]})
+    # killed in the middle of writing AAH-2
+    with open(filename, 'r+b') as f:
+        f.truncate(os.path.getsize(filename) - 10)
+
+    stream = run(filename, {'AAH-1': [first]}, previous_filename=filename, carried=['AAH-2'])
+    assert read_jsonl(filename) == [first]
+    assert read_jsonl(filename + '.diff') == []
+    assert stream.counts['carried'] == 0
+
+
+def test_carry_forward_unanalyzed_projects(tmp_path):
+    filename = str(tmp_path / 'findings.jsonl')
+    aah = finding('AAH-1', 'missing-backport', 1, 'stable-4.4')
+    bbb = finding('BBB-1', 'closed-without-merge', 2)
+    bbb_other = finding('BBB-2', 'closed-without-merge', 3)
+
+    run(filename, {'AAH-1': [aah], 'BBB-1': [bbb], 'BBB-2': [bbb_other]})
+
+    # --project BBB keeps AAH's records
+    stream = FindingsStream(filename, previous_filename=filename)
+    stream.emit('BBB-1', [bbb])
+    stream.emit('BBB-2', [bbb_other])
+    stream.carry_forward_unanalyzed(['BBB'])
+    stream.close()
+    assert sorted(x['issue'] for x in read_jsonl(filename)) == ['AAH-1', 'BBB-1', 'BBB-2']
+    assert read_jsonl(filename + '.diff') == []
+
+    # --issue BBB-1 keeps everything else
+    stream = FindingsStream(filename)
+    stream.emit('BBB-1', [])
+    stream.carry_forward_unanalyzed(['BBB'], issue='BBB-1')
+    stream.close()
+    assert sorted(x['issue'] for x in read_jsonl(filename)) == ['AAH-1', 'BBB-2']
+
+
+def test_carry_forward_keeps_skipped_issues(tmp_path):
+    filename = str(tmp_path / 'findings.jsonl')
+    first = finding('AAH-1', 'missing-backport', 1, 'stable-4.4')
+    second = finding('AAH-2', 'closed-without-merge', 2)
+
+    run(filename, {'AAH-1': [first], 'AAH-2': [second]})
+
+    # a run that only got to AAH-1 still reports AAH-2
+    run(filename, {'AAH-1': [first]}, carried=['AAH-2'])
+    assert read_jsonl(filename) == [first, second]
+
+    # and a diff against it does not see AAH-2 as changed
+    stream = run(filename, {'AAH-1': [first]}, previous_filename=filename, carried=['AAH-2'])
+    assert read_jsonl(filename) == [first, second]
+    assert read_jsonl(filename + '.diff') == []
+    assert stream.counts['carried'] == 1
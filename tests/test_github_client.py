@@ -0,0 +1,54 @@
+import pytest
+
+from lib.archive import TrafficArchive
+from lib.github_client import GithubClient
+from lib.github_client import endpoint_class
+
+
+PR_URL = 'https://api.github.com/repos/ansible/galaxy_ng/pulls/1'
+
+
+@pytest.mark.parametrize('api_url,expected', [
+    ('https://api.github.com/repos/ansible/galaxy_ng/pulls/1370', 'pulls'),
+    ('https://api.github.com/repos/ansible/galaxy_ng/issues/1370/timeline?page=2', 'issues/timeline'),
+    ('https://api.github.com/repos/ansible/galaxy_ng/commits/' + 'a' * 40 + '/pulls', 'commits/pulls'),
+    ('https://api.github.com/repos/ansible/galaxy_ng/branches', 'branches'),
+    ('https://api.github.com/rate_limit', 'rate_limit'),
+    ('https://api.github.com/', 'root'),
+])
+def test_endpoint_class(api_url, expected):
+    assert endpoint_class(api_url) == expected
+
+
+def replay_client(tmp_path, status, body):
+    filename = str(tmp_path / 'traffic.arc')
+    archive = TrafficArchive(filename, 'record')
+    archive.record(PR_URL, status, body)
+    archive.close()
+    return GithubClient(archive=TrafficArchive(filename, 'replay'))
+
+
+@pytest.mark.parametrize('status,body', [
+    (401, '{"message": "Bad credentials"}'),
+    (502, '<html>bad gateway</html>'),
+    (200, '{"message": "You have triggered an abuse detection mechanism"}'),
+])
+def test_error_responses_are_not_registered(tmp_path, status, body):
+    gc = replay_client(tmp_path, status, body)
+    with pytest.raises(Exception, match='could not fetch PR'):
+        gc.get_pullrequest('https://github.com/ansible/galaxy_ng/pull/1')
+    assert gc.pullrequests == {}
+
+
+def test_not_found(tmp_path):
+    gc = replay_client(tmp_path, 404, '{"message": "Not Found"}')
+    with pytest.raises(Exception, match='PR not found'):
+        gc.get_pullrequest('https://github.com/ansible/galaxy_ng/pull/1')
+
+
+def test_pull_request_is_registered(tmp_path):
+    body = '{"html_url": "https://github.com/ansible/galaxy_ng/pull/1", "base": {"ref": "main"}}'
+    gc = replay_client(tmp_path, 200, body)
+    pr = gc.get_pullrequest('https://github.com/ansible/galaxy_ng/pull/1')
+    assert pr.branch_name == 'main'
+    assert gc.get_pullrequest('https://github.com/ansible/galaxy_ng/pull/1') is pr
@@ -0,0 +1,71 @@
+import json
+import pstats
+import threading
+
+from lib.profiler import Profiler
+
+
+def test_to_dict():
+    profiler = Profiler(enabled=True)
+    with profiler.stage('process_jira_issues'):
+        with profiler.issue('AAH-1'):
+            pass
+    profiler.record_http('pulls', 200, 0.02)
+    profiler.record_http('pulls', 404, 3.0)
+    profiler.record_subprocess('git clone', 1.5)
+    profiler.record_cache('http', True)
+    profiler.record_cache('http', True)
+    profiler.record_cache('http', False)
+    profiler.record_cache('checkout', False)
+    profiler.set_gauge('github_ratelimit_remaining', 4999)
+
+    ds = profiler.to_dict()
+    assert ds['stages']['process_jira_issues']['count'] == 1
+    assert 'AAH-1' in ds['issues']
+    assert ds['http']['pulls']['count'] == 2
+    assert ds['http']['pulls']['statuses'] == {'200': 1, '404': 1}
+    assert ds['http']['pulls']['latency'] == {'<=0.05': 1, '<=5.0': 1}
+    assert ds['http']['pulls']['max'] == 3.0
+    assert ds['subprocesses']['git clone'] == {'count': 1, 'total': 1.5, 'max': 1.5}
+    assert ds['caches']['http']['hit_ratio'] == 2 / 3
+    assert ds['caches']['checkout']['hit_ratio'] == 0.0
+    assert ds['gauges'] == {'github_ratelimit_remaining': 4999}
+    # profile.json has to be serializable
+    json.dumps(ds)
+
+
+def test_disabled_is_a_noop():
+    profiler = Profiler()
+    with profiler.stage('sync'):
+        with profiler.issue('AAH-1'):
+            pass
+    profiler.record_http('pulls', 200, 0.1)
+    profiler.record_cache('http', True)
+
+    ds = profiler.to_dict()
+    assert ds['stages'] == {}
+    assert ds['issues'] == {}
+    assert ds['http'] == {}
+    assert ds['caches'] == {}
+
+
+def shard_work():
+    return sum(range(1000))
+
+
+def test_cprofile_includes_threads(tmp_path):
+    filename = str(tmp_path / 'analyzer.pstats')
+    profiler = Profiler(cprofile_file=filename)
+    profiler.start()
+
+    def run():
+        with profiler.thread():
+            shard_work()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+    stats = pstats.Stats(filename)
+    assert 'shard_work' in [x[2] for x in stats.stats]